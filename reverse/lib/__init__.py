@@ -19,15 +19,18 @@
 
 import sys
 import os
+import time
 from argparse import ArgumentParser, FileType
 
 from lib.disassembler import Disassembler
-from lib.utils import die, error
-from lib.generate_ast import generate_ast
+from lib.utils import die, error, warning
+from lib.generate_ast import generate_ast, generate_ast_flat
+from lib.structure import generate_ast_dom
 from lib.vim import generate_vim_syntax
 from lib.context import Context
 from lib.exceptions import (ExcSymNotFound, ExcNotExec, ExcArch,
-     ExcFileFormat, ExcNotAddr, ExcIfelse, ExcPEFail, ExcSectionNotFound)
+     ExcFileFormat, ExcNotAddr, ExcIfelse, ExcPEFail, ExcSectionNotFound,
+     ExcLimit, ExcRawMap)
 
 
 def parse_args():
@@ -55,6 +58,8 @@ def parse_args():
             help='Print all calls which are in the given section')
     parser.add_argument('--sections', action='store_true',
             help='Print all sections')
+    parser.add_argument('--strings', action='store_true',
+            help='Print all strings which are in the data sections')
     parser.add_argument('--dump', action='store_true',
             help='Dump asm without decompilation')
     parser.add_argument('--data', action='store_true',
@@ -74,8 +79,26 @@ def parse_args():
             help='Consider the input file as a raw binary')
     parser.add_argument('--rawbase', metavar='0xXXXXX',
             help='Set base address of a raw file (default=0)')
+    parser.add_argument('--rawmap', metavar='FILENAME',
+            help=('Segments of a raw file (with --raw). Line format: '
+            'NAME OFFSET_HEXA SIZE_HEXA ADDRESS_HEXA [x], x if the '
+            'segment is executable'))
     parser.add_argument('--rawbe', action='store_true',
             help='If not set it\'s in little endian')
+    parser.add_argument('--dominators', action='store_true',
+            help='Use the dominators for the decompilation instead of '
+            'enumerating all paths (faster on big functions)')
+    parser.add_argument('--maxpaths', type=int, metavar='N',
+            help='default 100000, if the function has more paths, only the '
+            'blocks are printed (0 = no limit, not with --dominators)')
+    parser.add_argument('--maxloops', type=int, metavar='N',
+            help='default 10000, same as --maxpaths for the loops')
+    parser.add_argument('--timelimit', type=int, default=0, metavar='SECONDS',
+            help='default 0 (no limit), same as --maxpaths for the time of '
+            'the decompilation')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+            help='default 1, number of processes used to disassemble the '
+            'big sections (--calls)')
 
     args = parser.parse_args()
 
@@ -99,9 +122,14 @@ def parse_args():
     ctx.lines           = args.lines
     ctx.graph           = args.graph
     ctx.raw_big_endian  = args.rawbe
+    ctx.raw_map         = args.rawmap
     ctx.list_sections   = args.sections
+    ctx.list_strings    = args.strings
     ctx.print_bytes     = args.bytes
     ctx.print_data      = args.data
+    ctx.dominators      = args.dominators
+    ctx.time_limit      = args.timelimit
+    ctx.jobs            = args.jobs
 
     if ctx.raw_base is not None:
         if ctx.raw_base.startswith("0x"):
@@ -112,6 +140,28 @@ def parse_args():
     else:
         ctx.raw_base = 0
 
+    if ctx.jobs < 1:
+        error("--jobs must be at least 1")
+        die()
+
+    # There are no paths with --dominators, only --timelimit is used
+    if args.maxpaths is not None or args.maxloops is not None:
+        if ctx.dominators:
+            error("--maxpaths and --maxloops can't be used with --dominators")
+            die()
+        if args.maxpaths is not None:
+            ctx.max_paths = args.maxpaths
+        if args.maxloops is not None:
+            ctx.max_loops = args.maxloops
+
+    if ctx.raw_map is not None:
+        if ctx.raw_type is None and not ctx.interactive:
+            error("--rawmap is used only with --raw")
+            die()
+        if not os.path.isfile(ctx.raw_map):
+            error("file %s doesn't exists" % ctx.raw_map)
+            die()
+
     return ctx
 
 
@@ -130,7 +180,8 @@ def load_file(ctx):
 
     try:
         dis = Disassembler(ctx.filename, ctx.raw_type,
-                           ctx.raw_base, ctx.raw_big_endian)
+                           ctx.raw_base, ctx.raw_big_endian, ctx.raw_map,
+                           ctx.jobs)
     except ExcArch as e:
         error("arch %s is not supported" % e.arch)
         if ctx.interactive:
@@ -141,6 +192,12 @@ def load_file(ctx):
         if ctx.interactive:
             return False
         die()
+    except ExcRawMap as e:
+        error("%s:%d: bad segment, the format is "
+              "NAME OFFSET_HEXA SIZE_HEXA ADDRESS_HEXA [x]" % (e.filename, e.line))
+        if ctx.interactive:
+            return False
+        die()
     except ExcPEFail as e:
         error(str(e.e))
         error("It seems that pefile.parse_data_directories is bugged.")
@@ -205,21 +262,43 @@ def disasm(ctx):
     if ctx.gph == None:
         error("capstone can't disassemble here")
         return
-    paths = ctx.gph.get_paths()
-    paths.gph = ctx.gph
-    paths.cache_obj()
-    
-    if ctx.graph:
-        ctx.gph.html_graph()
+
+    start = time.time()
+    if ctx.time_limit:
+        ctx.deadline = start + ctx.time_limit
 
     try:
-        ast = generate_ast(ctx, paths)
+        if ctx.dominators:
+            ast = generate_ast_dom(ctx, ctx.gph)
+            if ctx.graph:
+                ctx.gph.html_graph()
+        else:
+            paths = ctx.gph.get_paths(ctx.max_paths, ctx.max_loops,
+                                      ctx.deadline)
+            paths.gph = ctx.gph
+            paths.cache_obj()
+
+            if ctx.graph:
+                ctx.gph.html_graph()
+
+            ast = generate_ast(ctx, paths)
+
     except ExcIfelse as e:
         error("can't have a ifelse here     %x" % e.addr)
         if ctx.interactive:
             return
         die()
 
+    except ExcLimit as e:
+        if e.nb_blocks != -1:
+            count = "%d blocks" % e.nb_blocks
+        else:
+            count = "%d paths" % e.nb_paths
+        warning("limit of %s reached (%s, %d loops, %fs), "
+                "only the blocks are printed" %
+                (e.limit, count, e.nb_loops, time.time() - start))
+        ast = generate_ast_flat(ctx, ctx.gph)
+
     if ctx.vim:
         base = os.path.basename(ctx.filename)
         # re-assign if no colors
@@ -248,6 +327,10 @@ def reverse(ctx):
         ctx.dis.print_symbols(ctx.sectionsname)
         return
 
+    if ctx.list_strings:
+        ctx.dis.print_strings()
+        return
+
     init_addr(ctx)
 
     if ctx.calls_in_section is not None:
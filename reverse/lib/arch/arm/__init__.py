@@ -2,7 +2,8 @@ import lib.arch.arm.output
 import lib.arch.arm.utils
 import lib.arch.arm.process_ast
 
+# Passes on the ast, they are run in this order on each node
 registered = [
-    process_ast.convert_cond_to_if,
-    process_ast.fuse_inst_with_if,
+    process_ast.ConvertCondToIf,
+    process_ast.FuseInstWithIf,
 ]
@@ -33,7 +33,7 @@ from capstone.arm import (ARM_INS_EOR, ARM_INS_AND, ARM_INS_ORR, ARM_OP_IMM,
 from lib.output import (OutputAbs, print_no_end, print_tabbed_no_end,
         print_comment, print_comment_no_end)
 from lib.colors import (color, color_addr, color_retcall, color_string,
-        color_section, color_type)
+        color_section, color_type, color_symbol)
 from lib.utils import BYTES_PRINTABLE_SET
 from lib.arch.arm.utils import (inst_symbol, is_call, is_jump, is_ret,
     is_uncond_jump, cond_symbol)
@@ -123,9 +123,14 @@ class Output(OutputAbs):
                 if is_data:
                     s = self.binary.get_string(imm, self.ctx.max_data_size)
                     print_no_end(" " + color_string(s))
-                if imm in self.binary.reverse_symbols:
-                    print_no_end(" ")
-                    self.print_symbol(imm)
+                # Only a target can be inside a function, other
+                # immediates can be constants in the range of a function
+                if is_call(i) or is_jump(i):
+                    name = self.binary.get_symbol_name(imm)
+                else:
+                    name = self.binary.reverse_symbols.get(imm)
+                if name is not None:
+                    print_no_end(" " + color_symbol("<" + name + ">"))
             elif hexa:
                 print_no_end(hex(imm))
             else:
@@ -21,8 +21,8 @@ from capstone.arm import ARM_OP_IMM, ARM_INS_CMP, ARM_CC_AL, ARM_INS_TST
 
 from lib.colors import pick_color
 from lib.utils import BRANCH_NEXT
-from lib.ast import (Ast_Branch, Ast_Goto, Ast_Loop, Ast_IfGoto, Ast_Ifelse,
-        Ast_AndIf, Ast_If_cond)
+from lib.ast import (Ast_Branch, Ast_IfGoto, Ast_Ifelse, Ast_AndIf,
+        Ast_If_cond, Ast_Pass, Ast_Walker)
 from lib.arch.arm.output import ASSIGNMENT_OPS
 from lib.arch.arm.utils import is_uncond_jump
 
@@ -32,74 +32,55 @@ FUSE_OPS.add(ARM_INS_CMP)
 FUSE_OPS.add(ARM_INS_TST)
 
 
-def assign_colors(ctx, ast):
-    if isinstance(ast, Ast_Branch):
-        for n in ast.nodes:
-            if isinstance(n, list):
-                if is_uncond_jump(n[0]) and n[0].operands[0].type == ARM_OP_IMM:
-                    nxt = ctx.gph.link_out[n[0].address][BRANCH_NEXT]
-                    pick_color(nxt)
-            else: # ast
-                assign_colors(ctx, n)
+# All passes are run in a single traversal by lib.ast.Ast_Walker, see
+# generate_ast.process_ast.
 
-    elif isinstance(ast, Ast_IfGoto) or isinstance(ast, Ast_Goto):
+class AssignColors(Ast_Pass):
+    def visit_block(self, blk):
+        if is_uncond_jump(blk[0]) and blk[0].operands[0].type == ARM_OP_IMM:
+            nxt = self.ctx.gph.link_out[blk[0].address][BRANCH_NEXT]
+            pick_color(nxt)
+
+    def visit_ifgoto(self, ast):
         pick_color(ast.addr_jump)
 
-    elif isinstance(ast, Ast_Ifelse):
-        assign_colors(ctx, ast.br_next_jump)
-        assign_colors(ctx, ast.br_next)
+    visit_goto = visit_ifgoto
 
-    elif isinstance(ast, Ast_Loop):
-        assign_colors(ctx, ast.branch)
-        if ast.epilog != None:
-            assign_colors(ctx, ast.epilog)
 
-    elif isinstance(ast, Ast_If_cond):
-        assign_colors(ctx, ast.br)
+def assign_colors(ctx, ast):
+    Ast_Walker([AssignColors(ctx)], else_first=True).walk(ast)
 
 
-def fuse_inst_with_if(ctx, ast):
-    if isinstance(ast, Ast_Branch):
-        types_ast = (Ast_Ifelse, Ast_IfGoto, Ast_AndIf, Ast_If_cond)
+class FuseInstWithIf(Ast_Pass):
+    types_ast = (Ast_Ifelse, Ast_IfGoto, Ast_AndIf, Ast_If_cond)
+
+    def visit_branch(self, ast):
         for i, n in enumerate(ast.nodes):
             # TODO : try to do the same thing as x86
             if isinstance(n, list):
                 if n[-1].id in FUSE_OPS and i+1 < len(ast.nodes) and \
-                        isinstance(ast.nodes[i+1], types_ast):
+                        isinstance(ast.nodes[i+1], self.types_ast):
                     ast.nodes[i+1].fused_inst = n[-1]
-                    ctx.all_fused_inst.add(n[-1].address)
-            else: # ast
-                fuse_inst_with_if(ctx, n)
-
-    # elif isinstance(ast, Ast_If_cond):
-        # fuse_inst_with_if(ctx, ast.br)
-
-    elif isinstance(ast, Ast_Ifelse):
-        fuse_inst_with_if(ctx, ast.br_next)
-        fuse_inst_with_if(ctx, ast.br_next_jump)
+                    self.ctx.all_fused_inst.add(n[-1].address)
 
-    elif isinstance(ast, Ast_Loop):
-        fuse_inst_with_if(ctx, ast.branch)
-        if ast.epilog != None:
-            fuse_inst_with_if(ctx, ast.epilog)
 
-
-def convert_cond_to_if(ctx, ast):
-
-    def add_node(i, last_cond, br_lst):
-        if br_lst:
-            if last_cond == ARM_CC_AL:
-                added_nodes[i].append(br_lst)
-            else:
-                br = Ast_Branch()
-                br.add(br_lst)
-                added_nodes[i].append(Ast_If_cond(last_cond, br))
-
-    if isinstance(ast, Ast_Branch):
+class ConvertCondToIf(Ast_Pass):
+    # It must be the first pass : the new nodes are visited by the
+    # next passes.
+    def visit_branch(self, ast):
         # Temporary dict, because we can't modify nodes while we are
         # looping, we store new nodes here with the corresponding index
         added_nodes = {}
 
+        def add_node(i, last_cond, br_lst):
+            if br_lst:
+                if last_cond == ARM_CC_AL:
+                    added_nodes[i].append(br_lst)
+                else:
+                    br = Ast_Branch()
+                    br.add(br_lst)
+                    added_nodes[i].append(Ast_If_cond(last_cond, br))
+
         for i, n in enumerate(ast.nodes):
             if isinstance(n, list):
                 # This will split the current block in other branch if
@@ -120,9 +101,6 @@ def convert_cond_to_if(ctx, ast):
                     last_cond = inst.cc
                 add_node(i, last_cond, br)
 
-            else: # ast
-                convert_cond_to_if(ctx, n)
-
         # Now we update the nodes list. If we have split a block n
         # we remove it, and add new nodes.
         idx_keys = list(added_nodes.keys())
@@ -133,12 +111,3 @@ def convert_cond_to_if(ctx, ast):
                 # node is a list (blk of instructions) or Ast_If_cond
                 for k, node in enumerate(added_nodes[i]):
                     ast.nodes.insert(i+k, node)
-
-    elif isinstance(ast, Ast_Ifelse):
-        convert_cond_to_if(ctx, ast.br_next_jump)
-        convert_cond_to_if(ctx, ast.br_next)
-
-    elif isinstance(ast, Ast_Loop):
-        convert_cond_to_if(ctx, ast.branch)
-        if ast.epilog != None:
-            convert_cond_to_if(ctx, ast.epilog)
@@ -2,9 +2,10 @@ import lib.arch.mips.output
 import lib.arch.mips.utils
 import lib.arch.mips.process_ast
 
+# Passes on the ast, they are run in this order on each node
 registered = [
     # TODO
-    # process_ast.fuse_inst_with_if,
+    # process_ast.FuseInstWithIf,
 
-    process_ast.search_li,
+    process_ast.SearchLi,
 ]
@@ -22,8 +22,8 @@ from capstone.mips import (MIPS_OP_IMM, MIPS_INS_ADDIU, MIPS_INS_ORI,
 
 from lib.colors import pick_color
 from lib.utils import BRANCH_NEXT
-from lib.ast import (Ast_Branch, Ast_Goto, Ast_Loop, Ast_IfGoto, Ast_Ifelse,
-        Ast_AndIf, Ast_If_cond)
+from lib.ast import (Ast_IfGoto, Ast_Ifelse, Ast_AndIf, Ast_If_cond,
+        Ast_Pass, Ast_Walker)
 from lib.arch.mips.output import ASSIGNMENT_OPS
 from lib.arch.mips.utils import is_uncond_jump, PseudoInst, NopInst
 
@@ -33,63 +33,43 @@ FUSE_OPS = set(ASSIGNMENT_OPS)
 # FUSE_OPS.add(ARM_INS_TST)
 
 
-def assign_colors(ctx, ast):
-    if isinstance(ast, Ast_Branch):
-        for n in ast.nodes:
-            if isinstance(n, list):
-                if is_uncond_jump(n[0]) and n[0].operands[0].type == MIPS_OP_IMM:
-                    nxt = ctx.gph.link_out[n[0].address][BRANCH_NEXT]
-                    pick_color(nxt)
-            else: # ast
-                assign_colors(ctx, n)
+# All passes are run in a single traversal by lib.ast.Ast_Walker, see
+# generate_ast.process_ast.
+
+class AssignColors(Ast_Pass):
+    def visit_block(self, blk):
+        if is_uncond_jump(blk[0]) and blk[0].operands[0].type == MIPS_OP_IMM:
+            nxt = self.ctx.gph.link_out[blk[0].address][BRANCH_NEXT]
+            pick_color(nxt)
 
-    elif isinstance(ast, Ast_IfGoto) or isinstance(ast, Ast_Goto):
+    def visit_ifgoto(self, ast):
         pick_color(ast.addr_jump)
 
-    elif isinstance(ast, Ast_Ifelse):
-        assign_colors(ctx, ast.br_next_jump)
-        assign_colors(ctx, ast.br_next)
+    visit_goto = visit_ifgoto
 
-    elif isinstance(ast, Ast_Loop):
-        assign_colors(ctx, ast.branch)
-        if ast.epilog != None:
-            assign_colors(ctx, ast.epilog)
 
-    elif isinstance(ast, Ast_If_cond):
-        assign_colors(ctx, ast.br)
+def assign_colors(ctx, ast):
+    Ast_Walker([AssignColors(ctx)], else_first=True).walk(ast)
 
 
 # TODO !!
-def fuse_inst_with_if(ctx, ast):
-    if isinstance(ast, Ast_Branch):
-        types_ast = (Ast_Ifelse, Ast_IfGoto, Ast_AndIf, Ast_If_cond)
+class FuseInstWithIf(Ast_Pass):
+    types_ast = (Ast_Ifelse, Ast_IfGoto, Ast_AndIf, Ast_If_cond)
+
+    def visit_branch(self, ast):
         for i, n in enumerate(ast.nodes):
             # TODO : try to do the same thing as x86
             if isinstance(n, list):
                 if n[-1].id in FUSE_OPS and i+1 < len(ast.nodes) and \
-                        isinstance(ast.nodes[i+1], types_ast):
+                        isinstance(ast.nodes[i+1], self.types_ast):
                     ast.nodes[i+1].fused_inst = n[-1]
-                    ctx.all_fused_inst.add(n[-1].address)
-            else: # ast
-                fuse_inst_with_if(ctx, n)
-
-    # elif isinstance(ast, Ast_If_cond):
-        # fuse_inst_with_if(ctx, ast.br)
-
-    elif isinstance(ast, Ast_Ifelse):
-        fuse_inst_with_if(ctx, ast.br_next)
-        fuse_inst_with_if(ctx, ast.br_next_jump)
-
-    elif isinstance(ast, Ast_Loop):
-        fuse_inst_with_if(ctx, ast.branch)
-        if ast.epilog != None:
-            fuse_inst_with_if(ctx, ast.epilog)
+                    self.ctx.all_fused_inst.add(n[-1].address)
 
 
 LI_INST = [MIPS_INS_ADDIU, MIPS_INS_ORI]
 
 
-def __blk_search_li(blk):
+def blk_search_li(blk):
     prev_k = -1
     prev_i = None
     prev_op = None
@@ -130,19 +110,6 @@ def __blk_search_li(blk):
         prev_op = i.operands
 
 
-def search_li(ctx, ast):
-    if isinstance(ast, Ast_Branch):
-        for n in ast.nodes:
-            if isinstance(n, list):
-                __blk_search_li(n)
-            else: # ast
-                search_li(ctx, n)
-
-    elif isinstance(ast, Ast_Ifelse):
-        search_li(ctx, ast.br_next_jump)
-        search_li(ctx, ast.br_next)
-
-    elif isinstance(ast, Ast_Loop):
-        search_li(ctx, ast.branch)
-        if ast.epilog != None:
-            search_li(ctx, ast.epilog)
+class SearchLi(Ast_Pass):
+    def visit_block(self, blk):
+        blk_search_li(blk)
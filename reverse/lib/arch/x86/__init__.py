@@ -3,9 +3,10 @@ import lib.arch.x86.utils
 import lib.arch.x86.process_ast
 import lib.arch.x86.int80
 
+# Passes on the ast, they are run in this order on each node
 registered = [
-    process_ast.fuse_inst_with_if,
-    process_ast.search_local_vars,
-    process_ast.search_canary_plt,
-    int80.int80,
+    process_ast.FuseInstWithIf,
+    process_ast.SearchLocalVars,
+    process_ast.SearchCanaryPlt,
+    int80.Int80,
 ]
@@ -24,12 +24,8 @@ from capstone.x86 import (X86_REG_EBX, X86_REG_ECX, X86_REG_EDX, X86_REG_ESI,
         X86_INS_MOV, X86_INS_XOR, X86_OP_REG, X86_REG_ESI, X86_REG_RSI,
         X86_REG_RDI, X86_REG_EDI)
 
-from lib.colors import pick_color
-from lib.utils import BRANCH_NEXT
 from lib.output import INTERN_COMMENTS
-from lib.ast import (Ast_Branch, Ast_Goto, Ast_Loop, Ast_IfGoto, Ast_Ifelse,
-        Ast_AndIf)
-from lib.arch.x86.utils import is_uncond_jump, is_call
+from lib.ast import Ast_Pass
 
 
 ARGS_ORDER = {
@@ -326,20 +322,6 @@ def read_block(ctx, blk):
         INTERN_COMMENTS[inst.address] += ")"
 
 
-def int80(ctx, ast):
-    if isinstance(ast, Ast_Branch):
-        for n in ast.nodes:
-            if isinstance(n, list):
-                read_block(ctx, n)
-            else: # ast
-                int80(ctx, n)
-
-    elif isinstance(ast, Ast_Ifelse):
-        int80(ctx, ast.br_next_jump)
-        int80(ctx, ast.br_next)
-
-    elif isinstance(ast, Ast_Loop):
-        int80(ctx, ast.branch)
-        if ast.epilog != None:
-            int80(ctx, ast.epilog)
-
+class Int80(Ast_Pass):
+    def visit_block(self, blk):
+        read_block(self.ctx, blk)
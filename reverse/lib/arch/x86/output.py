@@ -22,7 +22,7 @@ import struct
 from lib.output import (OutputAbs, print_no_end, print_tabbed_no_end,
         print_comment, print_comment_no_end, INTERN_COMMENTS)
 from lib.colors import (color, color_addr, color_retcall, color_string,
-        color_var, color_section, color_intern_comment)
+        color_var, color_section, color_intern_comment, color_symbol)
 from lib.utils import get_char, BYTES_PRINTABLE_SET
 from lib.arch.x86.utils import (inst_symbol, is_call, is_jump, is_ret,
     is_uncond_jump, cond_symbol)
@@ -80,9 +80,14 @@ class Output(OutputAbs):
                 if is_data:
                     s = self.binary.get_string(imm, self.ctx.max_data_size)
                     print_no_end(" " + color_string(s))
-                if imm in self.binary.reverse_symbols:
-                    print_no_end(" ")
-                    self.print_symbol(imm)
+                # Only a target can be inside a function, other
+                # immediates can be constants in the range of a function
+                if is_call(i) or is_jump(i):
+                    name = self.binary.get_symbol_name(imm)
+                else:
+                    name = self.binary.reverse_symbols.get(imm)
+                if name is not None:
+                    print_no_end(" " + color_symbol("<" + name + ">"))
             elif op.size == 1:
                 print_no_end(color_string("'%s'" % get_char(imm)))
             elif hexa:
@@ -22,8 +22,8 @@ from capstone.x86 import (X86_INS_CMP, X86_INS_MOV, X86_INS_TEST, X86_OP_IMM,
 
 from lib.colors import pick_color
 from lib.utils import BRANCH_NEXT
-from lib.ast import (Ast_Branch, Ast_Goto, Ast_Loop, Ast_IfGoto, Ast_Ifelse,
-        Ast_AndIf)
+from lib.ast import (Ast_Loop, Ast_IfGoto, Ast_Ifelse, Ast_AndIf, Ast_Pass,
+        Ast_Walker)
 from lib.arch.x86.output import ASSIGNMENT_OPS
 from lib.arch.x86.utils import is_uncond_jump, is_call
 
@@ -36,56 +36,43 @@ def inv(n):
     return n == X86_OP_INVALID
 
 
-def assign_colors(ctx, ast):
-    if isinstance(ast, Ast_Branch):
-        for n in ast.nodes:
-            if isinstance(n, list):
-                if is_uncond_jump(n[0]) and n[0].operands[0].type == X86_OP_IMM:
-                    nxt = ctx.gph.link_out[n[0].address][BRANCH_NEXT]
-                    pick_color(nxt)
-            else: # ast
-                assign_colors(ctx, n)
+# All passes are run in a single traversal by lib.ast.Ast_Walker, see
+# generate_ast.process_ast.
 
-    elif isinstance(ast, Ast_IfGoto) or isinstance(ast, Ast_Goto):
+class AssignColors(Ast_Pass):
+    def visit_block(self, blk):
+        if is_uncond_jump(blk[0]) and blk[0].operands[0].type == X86_OP_IMM:
+            nxt = self.ctx.gph.link_out[blk[0].address][BRANCH_NEXT]
+            pick_color(nxt)
+
+    def visit_ifgoto(self, ast):
         pick_color(ast.addr_jump)
 
-    elif isinstance(ast, Ast_Ifelse):
-        assign_colors(ctx, ast.br_next_jump)
-        assign_colors(ctx, ast.br_next)
+    visit_goto = visit_ifgoto
+
 
-    elif isinstance(ast, Ast_Loop):
-        assign_colors(ctx, ast.branch)
-        if ast.epilog != None:
-            assign_colors(ctx, ast.epilog)
+def assign_colors(ctx, ast):
+    Ast_Walker([AssignColors(ctx)], else_first=True).walk(ast)
 
 
-def fuse_inst_with_if(ctx, ast):
-    if isinstance(ast, Ast_Branch):
-        types_ast = (Ast_Ifelse, Ast_IfGoto, Ast_AndIf)
+class FuseInstWithIf(Ast_Pass):
+    types_ast = (Ast_Ifelse, Ast_IfGoto, Ast_AndIf)
+
+    def visit_branch(self, ast):
         for i, n in enumerate(ast.nodes):
             if isinstance(n, list):
                 if ((n[-1].id in FUSE_OPS or (n[-1].id == X86_INS_TEST and
                     all(op.type == X86_OP_REG for op in n[-1].operands) and
                     len(set(op.value.reg for op in n[-1].operands)) == 1))
                     and i+1 < len(ast.nodes)
-                            and isinstance(ast.nodes[i+1], types_ast)):
+                            and isinstance(ast.nodes[i+1], self.types_ast)):
                     ast.nodes[i+1].fused_inst = n[-1]
-                    ctx.all_fused_inst.add(n[-1].address)
-            else: # ast
-                fuse_inst_with_if(ctx, n)
-
-    elif isinstance(ast, Ast_Ifelse):
-        fuse_inst_with_if(ctx, ast.br_next)
-        fuse_inst_with_if(ctx, ast.br_next_jump)
-
-    elif isinstance(ast, Ast_Loop):
-        fuse_inst_with_if(ctx, ast.branch)
-        if ast.epilog != None:
-            fuse_inst_with_if(ctx, ast.epilog)
+                    self.ctx.all_fused_inst.add(n[-1].address)
 
 
-def search_local_vars(ctx, ast):
-    def save_vars(ctx, i):
+class SearchLocalVars(Ast_Pass):
+    def __save_vars(self, i):
+        ctx = self.ctx
         for op in i.operands:
             mm = op.mem
             if not inv(mm.base) and mm.disp != 0 \
@@ -97,37 +84,17 @@ def search_local_vars(ctx, ast):
                     ctx.local_vars_size.append(op.size)
                     ctx.vars_counter += 1
 
+    def visit_block(self, blk):
+        for inst in blk:
+            self.__save_vars(inst)
 
-    if isinstance(ast, Ast_Branch):
-        for i, n in enumerate(ast.nodes):
-            if isinstance(n, list):
-                for inst in n:
-                    save_vars(ctx, inst)
-            else: # ast
-                search_local_vars(ctx, n)
-
-    elif isinstance(ast, Ast_Ifelse):
-        if ast.fused_inst != None:
-            save_vars(ctx, ast.fused_inst)
-        search_local_vars(ctx, ast.br_next)
-        search_local_vars(ctx, ast.br_next_jump)
-
-    elif isinstance(ast, Ast_IfGoto):
+    # The fused instruction is set by FuseInstWithIf on the parent branch,
+    # so before we visit the node.
+    def visit_ifelse(self, ast):
         if ast.fused_inst != None:
-            save_vars(ctx, ast.fused_inst)
+            self.__save_vars(ast.fused_inst)
 
-    elif isinstance(ast, Ast_Loop):
-        search_local_vars(ctx, ast.branch)
-        if ast.epilog != None:
-            search_local_vars(ctx, ast.epilog)
-
-
-def search_canary_plt(ctx, ast):
-    fname = "__stack_chk_fail@plt"
-    if fname not in ctx.dis.binary.symbols:
-        return
-    faddr = ctx.dis.binary.symbols[fname]
-    __rec_search_canary_plt(faddr, ctx, ast, [])
+    visit_ifgoto = visit_ifelse
 
 
 def get_var_canary(ctx, last_block):
@@ -154,27 +121,40 @@ def get_var_canary(ctx, last_block):
             break
 
 
-def __rec_search_canary_plt(faddr, ctx, ast, last_block):
-    if isinstance(ast, Ast_Branch):
-        for n in ast.nodes:
-            if isinstance(n, list):
-                for i in n:
-                    if not is_call(i):
-                        continue
-                    op = i.operands[0]
-                    if op.type == X86_OP_IMM and op.value.imm == faddr:
-                        get_var_canary(ctx, last_block)
+class SearchCanaryPlt(Ast_Pass):
+    def __init__(self, ctx):
+        Ast_Pass.__init__(self, ctx)
+        # The name of the call target is checked : searching the address
+        # of __stack_chk_fail@plt would load all the symbols.
+        self.reverse_symbols = ctx.dis.binary.reverse_symbols
 
-                last_block = n
+        # id(node) -> last block before this node. It's set when the parent
+        # branch is visited, the call is searched when the block is visited
+        # (after SearchLocalVars).
+        self.last_block = {}
 
-            else: # ast
-                __rec_search_canary_plt(faddr, ctx, n, last_block)
+    def visit_branch(self, ast):
+        last_block = self.last_block.get(id(ast), [])
 
-    elif isinstance(ast, Ast_Ifelse):
-        __rec_search_canary_plt(faddr, ctx, ast.br_next_jump, last_block)
-        __rec_search_canary_plt(faddr, ctx, ast.br_next, last_block)
+        for n in ast.nodes:
+            if isinstance(n, list):
+                self.last_block[id(n)] = last_block
+                last_block = n
 
-    elif isinstance(ast, Ast_Loop):
-        __rec_search_canary_plt(faddr, ctx, ast.branch, last_block)
-        if ast.epilog != None:
-            __rec_search_canary_plt(faddr, ctx, ast.epilog, last_block)
+            elif isinstance(n, Ast_Ifelse):
+                self.last_block[id(n.br_next)] = last_block
+                self.last_block[id(n.br_next_jump)] = last_block
+
+            elif isinstance(n, Ast_Loop):
+                self.last_block[id(n.branch)] = last_block
+                if n.epilog != None:
+                    self.last_block[id(n.epilog)] = last_block
+
+    def visit_block(self, blk):
+        for i in blk:
+            if not is_call(i):
+                continue
+            op = i.operands[0]
+            if op.type == X86_OP_IMM and self.reverse_symbols.get(
+                    op.value.imm) == "__stack_chk_fail@plt":
+                get_var_canary(self.ctx, self.last_block.get(id(blk), []))
@@ -17,6 +17,8 @@
 # along with this program.    If not, see <http://www.gnu.org/licenses/>.
 #
 
+import re
+
 from capstone import CS_GRP_CALL, CS_GRP_JUMP, CS_GRP_RET
 from capstone.x86 import (X86_INS_ADD, X86_INS_AND, X86_INS_CMP, X86_INS_DEC,
         X86_INS_IMUL, X86_INS_INC, X86_INS_JA, X86_INS_JAE, X86_INS_JE,
@@ -28,6 +30,15 @@ from capstone.x86 import (X86_INS_ADD, X86_INS_AND, X86_INS_CMP, X86_INS_DEC,
         X86_INS_SHR, X86_INS_SUB, X86_INS_XOR, X86_INS_OR, X86_INS_MOVSX)
 
 
+# Used by print_calls to search the calls directly in the bytes :
+# call rel (e8), lcall ptr (9a), call r/m (ff /2) and lcall m (ff /3).
+# Only prefixes can be before the opcode (REX only in 64 bits).
+CALL_OPCODES = re.compile(
+        rb"[\xe8\x9a]|\xff(?=[\x10-\x1f\x50-\x5f\x90-\x9f\xd0-\xdf])")
+PREFIXES = frozenset(b"\xf0\xf2\xf3\x2e\x36\x3e\x26\x64\x65\x66\x67")
+REX_PREFIXES = frozenset(range(0x40, 0x50))
+
+
 def is_cmp(i):
     return i.id == X86_INS_CMP
 
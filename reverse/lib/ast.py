@@ -241,3 +241,82 @@ class Ast_Comment:
     def print(self, o, tab=0):
         if o.ctx.comments:
             print_comment("# " + self.text, tab)
+
+
+# Passes on the ast (fused instructions, local variables, colors...).
+#
+# A pass defines only the hooks it needs, one per type of node. For a
+# block of instructions (a list) the hook is visit_block. All passes of
+# an architecture are run by Ast_Walker in a single traversal.
+class Ast_Pass:
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+
+# Children of a node, in the reverse order of the traversal (they are
+# pushed on a stack).
+
+def __branch_children(ast):
+    return reversed(ast.nodes)
+
+def __ifelse_children(ast):
+    return (ast.br_next_jump, ast.br_next)
+
+def __ifelse_children_else_first(ast):
+    return (ast.br_next, ast.br_next_jump)
+
+def __loop_children(ast):
+    if ast.epilog != None:
+        return (ast.epilog, ast.branch)
+    return (ast.branch,)
+
+def __if_cond_children(ast):
+    return (ast.br,)
+
+def __no_children(ast):
+    return ()
+
+
+# type of node -> (name of the hook, children)
+AST_TYPES = {
+    list: ("visit_block", __no_children),
+    Ast_Branch: ("visit_branch", __branch_children),
+    Ast_IfGoto: ("visit_ifgoto", __no_children),
+    Ast_AndIf: ("visit_andif", __no_children),
+    Ast_If_cond: ("visit_if_cond", __if_cond_children),
+    Ast_Ifelse: ("visit_ifelse", __ifelse_children),
+    Ast_Goto: ("visit_goto", __no_children),
+    Ast_Loop: ("visit_loop", __loop_children),
+    Ast_Comment: ("visit_comment", __no_children),
+}
+
+# Children of an if/else with Ast_Walker(else_first=True)
+IFELSE_CHILDREN_ELSE_FIRST = __ifelse_children_else_first
+
+
+class Ast_Walker:
+    def __init__(self, passes, else_first=False):
+        # type of node -> (hooks in the same order as the passes, children)
+        self.table = {}
+        for ty, (name, children) in AST_TYPES.items():
+            hooks = [getattr(p, name) for p in passes if hasattr(p, name)]
+            if else_first and ty is Ast_Ifelse:
+                children = IFELSE_CHILDREN_ELSE_FIRST
+            self.table[ty] = (hooks, children)
+
+
+    # The tree is walked in preorder with an explicit stack : the if-part
+    # before the else-part (the opposite with else_first), the loop before
+    # its epilog. All hooks are called on a node before its children are
+    # read, so a hook on a branch can modify its nodes or set something on
+    # them.
+    def walk(self, ast):
+        table = self.table
+        stack = [ast]
+
+        while stack:
+            ast = stack.pop()
+            hooks, children = table[type(ast)]
+            for h in hooks:
+                h(ast)
+            stack.extend(children(ast))
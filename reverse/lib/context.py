@@ -45,9 +45,21 @@ class Context():
         self.debug = False
         self.raw_base = 0
         self.raw_big_endian = False
+        self.raw_map = None
         self.list_sections = False
+        self.list_strings = False
         self.print_bytes = False
         self.print_data = False
+        self.dominators = False
+
+        # Limits for the decompilation of a function, 0 = no limit.
+        # If one of them is reached, only the blocks are printed.
+        self.max_paths = 100000
+        self.max_loops = 10000
+        self.time_limit = 0 # seconds
+
+        # Number of processes used to disassemble the big sections
+        self.jobs = 1
 
 
     def reset_all(self):
@@ -70,6 +82,7 @@ class Context():
         self.local_vars_name = []
         self.vars_counter = 1
         self.seen = set()
+        self.deadline = 0 # see time_limit
 
         # If an address of an instruction cmp is here, it means that we
         # have fused with an if, so don't print this instruction.
@@ -18,8 +18,11 @@
 #
 
 import time
+import ctypes
 
 from lib.graph import Graph
+from lib.instruction import InstructionBuilder
+from lib.sweep import SectionSweep, FLAG_CALL
 from lib.utils import debug__, BYTES_PRINTABLE_SET, get_char
 from lib.fileformat.binary import Binary, T_BIN_PE
 from lib.output import print_no_end
@@ -29,11 +32,16 @@ from lib.exceptions import ExcSymNotFound, ExcArch, ExcNotAddr, ExcNotExec
 
 
 class Disassembler():
-    def __init__(self, filename, raw_type, raw_base, raw_big_endian):
+    def __init__(self, filename, raw_type, raw_base, raw_big_endian,
+                 raw_map=None, jobs=1):
         import capstone as CAPSTONE
 
         self.code = {}
-        self.binary = Binary(filename, raw_type, raw_base, raw_big_endian)
+        # Addresses of self.code in the order of the disassembly, the new
+        # instructions are at the end (see pe_reverse_stripped_symbols).
+        self.code_addrs = []
+        self.binary = Binary(filename, raw_type, raw_base, raw_big_endian,
+                             raw_map)
 
         arch, mode = self.binary.get_arch()
 
@@ -45,8 +53,15 @@ class Disassembler():
         self.md = CAPSTONE.Cs(arch, mode)
         self.md.detail = True
         self.arch = arch
+        # The instructions are saved in self.code with a compact copy
+        self.__builder = InstructionBuilder(self.md, self.binary)
         self.mode = mode
 
+        # section start -> SectionSweep
+        self.__sweeps = {}
+        # Number of processes used for the sweeps
+        self.jobs = jobs
+
 
     def check_addr(self, ctx, addr):
         addr_exists, is_exec = self.binary.check_addr(addr)
@@ -227,6 +242,7 @@ class Disassembler():
 
 
     def print_calls(self, ctx):
+        from capstone import CS_ARCH_X86, CS_MODE_64
         ARCH = self.load_arch_module()
         ARCH_UTILS = ARCH.utils
         ARCH_OUTPUT = ARCH.output
@@ -235,22 +251,80 @@ class Disassembler():
         self.print_section_meta(s_name, s_start, s_end)
         o = ARCH_OUTPUT.Output(ctx)
 
-        ad = s_start
-        while ad < s_end:
-            i = self.lazy_disasm(ad, s_start)
-            if i is None:
-                ad += 1
+        sweep = self.get_sweep(s_start)
+
+        # On x86 the calls are searched in the bytes, only these
+        # instructions are disassembled with the details.
+        if self.arch == CS_ARCH_X86:
+            prefixes = ARCH_UTILS.PREFIXES
+            if self.mode == CS_MODE_64:
+                prefixes = prefixes | ARCH_UTILS.REX_PREFIXES
+            rows = sweep.iter_opcode(ARCH_UTILS.CALL_OPCODES, prefixes)
+        else:
+            rows = sweep.iter_flag(FLAG_CALL)
+
+        for n in rows:
+            if sweep.addr[n] >= s_end:
+                break
+            i = self.__get_inst_from_sweep(sweep, n)
+            if ARCH_UTILS.is_call(i):
+                o.print_inst(i)
+
+
+    def print_xrefs(self, ctx, addr):
+        ARCH_OUTPUT = self.load_arch_module().output
+        o = ARCH_OUTPUT.Output(ctx)
+        seen = set()
+
+        for (_, start, _) in self.binary.iter_sections():
+            if not self.binary.check_addr(start)[1]:
+                continue
+            sweep = self.get_sweep(start)
+            if sweep is None or sweep.start in seen:
+                continue
+            seen.add(sweep.start)
+            for n in sweep.iter_xrefs(addr):
+                o.print_inst(self.__get_inst_from_sweep(sweep, n))
+
+
+    # The sweep is done once for each section, it's kept for the other
+    # commands in the interactive mode. The first call to lazy_disasm
+    # in an executable section does it.
+    def get_sweep(self, addr):
+        meta = self.binary.get_section_meta(addr)
+        if meta is None:
+            return None
+        return self.__get_sweep(*meta)
+
+
+    def __get_sweep(self, name, start, end):
+        sweep = self.__sweeps.get(start, None)
+        if sweep is None:
+            sweep = SectionSweep(self.md, self.binary,
+                                 self.load_arch_module().utils,
+                                 name, start, end, self.jobs)
+            self.__sweeps[start] = sweep
+        return sweep
+
+
+    def __get_inst_from_sweep(self, sweep, n):
+        ad = sweep.addr[n]
+        i = self.code.get(ad, None)
+        if i is None:
+            if sweep.has_detail():
+                i = self.__builder.build_from_row(*sweep.get_row(n))
             else:
-                ad += i.size
-                if ARCH_UTILS.is_call(i):
-                    o.print_inst(i)
+                i = self.__builder.build_at(ad, sweep.size[n])
+            self.code[ad] = i
+            self.code_addrs.append(ad)
+        return i
 
 
     def print_symbols(self, print_sections, sym_filter=None):
         if sym_filter is not None:
             sym_filter = sym_filter.lower()
 
-        for addr in self.binary.reverse_symbols:
+        for addr in self.binary.reverse_symbols.sorted_keys():
             sy = self.binary.reverse_symbols[addr]
             if sym_filter is None or sym_filter in sy.lower():
                 sec_name, _ = self.binary.is_address(addr)
@@ -262,6 +336,12 @@ class Disassembler():
                     print()
 
 
+    def print_strings(self, min_len=4):
+        for addr, s in self.binary.iter_strings(min_len):
+            print_no_end(color_addr(addr))
+            print(color_string(s))
+
+
     def load_user_sym_file(self, fd):
         for l in fd:
             arg = l.split()
@@ -275,31 +355,47 @@ class Disassembler():
         if meta is None:
             return None
 
-        _, start, _ = meta
+        name, start, end = meta
 
         if stay_in_section != -1 and start != stay_in_section:
             return None
 
         if addr in self.code:
             return self.code[addr]
-        
+
+        if self.binary.check_addr(addr)[1]:
+            sweep = self.__get_sweep(name, start, end)
+            n = sweep.find(addr)
+            if n != -1:
+                return self.__get_inst_from_sweep(sweep, n)
+
+        # Not an executable section or the address is not aligned on
+        # the sweep (jump in the middle of an instruction).
         # Disassemble by block of N bytes
         N = 1024
 
         d = self.binary.section_stream_read(addr, N)
+        if not d:
+            return None
+
+        # d is a view on the mapped file, capstone reads it directly
+        d = (ctypes.c_char * len(d)).from_buffer(d)
         gen = self.md.disasm(d, addr)
 
         first = None
         try:
-            first = next(gen)
+            first = self.__builder.build(next(gen))
             self.code[first.address] = first
+            self.code_addrs.append(first.address)
 
             # Max N instructions (N is in bytes)
             for n in range(N):
                 i = next(gen)
                 if i.address in self.code:
                     return first
+                i = self.__builder.build(i)
                 self.code[i.address] = i
+                self.code_addrs.append(i.address)
         except StopIteration:
             pass
 
@@ -325,11 +421,31 @@ class Disassembler():
         start = time.clock()
         prefetch = None
 
+        insts = {}     # address -> instruction
+        inst_out = {}  # address -> list of next addresses
+        prefetches = {}
+        nb_in = {}     # address -> number of predecessors
+        jumps = set()
+
+        def set_next(curr, lst):
+            inst_out[curr.address] = lst
+            for ad in lst:
+                nb_in[ad] = nb_in.get(ad, 0) + 1
+            rest.extend(reversed(lst))
+
         # WARNING: this assume that on every architectures the jump
         # address is the last operand (operands[-1])
 
+        # First pass : follow the flow and store the next addresses of
+        # each instruction.
+
         while 1:
-            if not gph.exists(curr):
+            if curr.address not in insts:
+                insts[curr.address] = curr
+
+                if ARCH_UTILS.is_jump(curr):
+                    jumps.add(curr.address)
+
                 if self.arch == CS_ARCH_MIPS:
                     prefetch = self.__prefetch_inst(curr)
 
@@ -337,11 +453,9 @@ class Disassembler():
                     if curr.operands[-1].type == CS_OP_IMM:
                         addr = curr.operands[-1].value.imm
                         nxt = self.lazy_disasm(addr)
-                        gph.set_next(curr, nxt, prefetch)
-                        rest.append(nxt.address)
-                    else:
-                        # Can't interpret jmp ADDR|reg
-                        gph.add_node(curr, prefetch)
+                        set_next(curr, [nxt.address])
+                    # else Can't interpret jmp ADDR|reg
+                    prefetches[curr.address] = prefetch
                     gph.uncond_jumps_set.add(curr.address)
 
                 elif ARCH_UTILS.is_cond_jump(curr) and len(curr.operands) > 0:
@@ -355,36 +469,70 @@ class Disassembler():
                             direct_nxt = \
                                 self.lazy_disasm(curr.address + curr.size)
 
-                        gph.set_cond_next(curr, nxt_jump, direct_nxt, prefetch)
-                        rest.append(nxt_jump.address)
-                        rest.append(direct_nxt.address)
-                    else:
-                        # Can't interpret jmp ADDR|reg
-                        gph.add_node(curr, prefetch)
+                        set_next(curr, [direct_nxt.address, nxt_jump.address])
+                    # else Can't interpret jmp ADDR|reg
+                    prefetches[curr.address] = prefetch
                     gph.cond_jumps_set.add(curr.address)
 
                 elif ARCH_UTILS.is_ret(curr):
-                    gph.add_node(curr, prefetch)
+                    prefetches[curr.address] = prefetch
 
                 else:
-                    try:
-                        nxt = self.lazy_disasm(curr.address + curr.size)
-                        gph.set_next(curr, nxt)
-                        rest.append(nxt.address)
-                    except:
-                        gph.add_node(curr)
-                        pass
+                    nxt = self.lazy_disasm(curr.address + curr.size)
+                    if nxt is not None:
+                        set_next(curr, [nxt.address])
 
             try:
                 curr = self.lazy_disasm(rest.pop())
             except IndexError:
                 break
 
+        # Search the leaders : the entry, jumps, instructions with more or
+        # less than one predecessor and all next instructions of a jump
+        # (or of an instruction which has not one next).
+
+        leaders = {gph.entry_point_addr}
+        for ad in insts:
+            nxt = inst_out.get(ad, [])
+            if ad in jumps:
+                leaders.add(ad)
+                leaders.update(nxt)
+            elif len(nxt) != 1:
+                leaders.update(nxt)
+            if nb_in.get(ad, 0) != 1:
+                leaders.add(ad)
+
+        # Second pass : create the blocks. Jumps are alone in a block, but
+        # for some architectures we save the prefetched instruction after.
+
+        for ad in insts:
+            if ad not in leaders:
+                continue
+
+            blk = [insts[ad]]
+            nxt = inst_out.get(ad, [])
+
+            if ad in prefetches:
+                if prefetches[ad] is not None:
+                    blk.append(prefetches[ad])
+            else:
+                while len(nxt) == 1 and nxt[0] not in leaders:
+                    n = nxt[0]
+                    blk.append(insts[n])
+                    # A return can be at the end of a block, with its
+                    # prefetched instruction (mips delay slot).
+                    if prefetches.get(n, None) is not None:
+                        blk.append(prefetches[n])
+                    nxt = inst_out.get(n, [])
+
+            gph.add_block(blk, nxt)
+
         if self.binary.type == T_BIN_PE:
             self.binary.pe_reverse_stripped_symbols(self)
 
         elapsed = time.clock()
         elapsed = elapsed - start
-        debug__("Graph built in %fs" % elapsed)
+        debug__("Graph built in %fs (%d instructions, %d blocks)" %
+                (elapsed, len(insts), len(gph.nodes)))
 
         return gph
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#
+# Reverse : Generate an indented asm code (pseudo-C) with colored syntax.
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Immediate dominators and post-dominators.
+#
+# The algorithm is the iterative one from Cooper, Harvey and Kennedy
+# ("A Simple, Fast Dominance Algorithm"). On a control flow graph it
+# converges in two or three passes over the reverse postorder, so it's
+# almost linear in the number of blocks.
+
+# Virtual node used as the unique exit when computing post-dominators.
+# Like everywhere else in the code -1 means "no address".
+VIRTUAL_EXIT = -1
+
+
+def reverse_postorder(entry, link_out):
+    # Iterative DFS, we don't want to depend on the recursion limit
+    order = []
+    seen = {entry}
+    stack = [(entry, iter(link_out.get(entry, [])))]
+
+    while stack:
+        node, it = stack[-1]
+        for nxt in it:
+            if nxt not in seen:
+                seen.add(nxt)
+                stack.append((nxt, iter(link_out.get(nxt, []))))
+                break
+        else:
+            stack.pop()
+            order.append(node)
+
+    order.reverse()
+    return order
+
+
+def compute_idom(entry, link_out):
+    rpo = reverse_postorder(entry, link_out)
+    po_num = {n: i for i, n in enumerate(reversed(rpo))}
+
+    preds = {n: [] for n in rpo}
+    for n in rpo:
+        for nxt in link_out.get(n, []):
+            preds[nxt].append(n)
+
+    idom = {entry: entry}
+
+    def intersect(b1, b2):
+        while b1 != b2:
+            while po_num[b1] < po_num[b2]:
+                b1 = idom[b1]
+            while po_num[b2] < po_num[b1]:
+                b2 = idom[b2]
+        return b1
+
+    changed = True
+    while changed:
+        changed = False
+        for n in rpo[1:]:
+            new_idom = None
+            for p in preds[n]:
+                if p not in idom:
+                    continue
+                if new_idom is None:
+                    new_idom = p
+                else:
+                    new_idom = intersect(p, new_idom)
+            if idom.get(n) != new_idom:
+                idom[n] = new_idom
+                changed = True
+
+    return idom
+
+
+# Post-dominators are the dominators of the reversed graph. Every block
+# without successors and every edge going to a block in `sinks` are
+# linked to VIRTUAL_EXIT. Edges going to a block which is not in `nodes`
+# are ignored. Blocks which can't reach an exit (infinite loops) are not
+# in the returned dict.
+def compute_ipdom(nodes, link_out, sinks=()):
+    rev = {VIRTUAL_EXIT: []}
+    for n in nodes:
+        rev[n] = []
+
+    for n in nodes:
+        nxt = link_out.get(n, [])
+        if not nxt:
+            rev[VIRTUAL_EXIT].append(n)
+            continue
+        for s in nxt:
+            if s in sinks:
+                rev[VIRTUAL_EXIT].append(n)
+            elif s in rev:
+                rev[s].append(n)
+
+    ipdom = compute_idom(VIRTUAL_EXIT, rev)
+    del ipdom[VIRTUAL_EXIT]
+    return ipdom
@@ -52,6 +52,24 @@ class ExcNotAddr(Exception):
         self.addr = addr
 
 
+# Raised when the exploration of the paths is too long (see the options
+# --maxpaths, --maxloops and --timelimit). With --dominators there are
+# no paths, nb_blocks is the number of blocks visited.
+class ExcLimit(Exception):
+    def __init__(self, limit, nb_paths, nb_loops, nb_blocks=-1):
+        self.limit = limit
+        self.nb_paths = nb_paths
+        self.nb_loops = nb_loops
+        self.nb_blocks = nb_blocks
+
+
+# A bad line in the map file of a raw binary (option --rawmap)
+class ExcRawMap(Exception):
+    def __init__(self, filename, line):
+        self.filename = filename
+        self.line = line
+
+
 class ExcPEFail(Exception):
     def __init__(self, e):
         self.e = e
@@ -17,9 +17,14 @@
 # along with this program.    If not, see <http://www.gnu.org/licenses/>.
 #
 
+import os
+import re
+import mmap
 import time
+from bisect import bisect_left, bisect_right
+from heapq import heappush, heappop
 
-from lib.utils import debug__
+from lib.utils import debug__, get_char
 from lib.exceptions import ExcFileFormat, ExcSectionNotFound
 
 T_BIN_ELF = 0
@@ -28,16 +33,318 @@ T_BIN_RAW = 2
 T_BIN_UNK = 3
 
 
+# Sorted index of the sections, an address is found with a bisect.
+#
+# sections is a list of (start, end, section) in the order of the file.
+# If two sections overlap (for example .tbss in ELF), an address is
+# given to the first one, like a linear search in the list. The
+# intervals are split and stored without overlap.
+class SectionIndex():
+    def __init__(self, sections):
+        self.__starts = []
+        self.__ends = []
+        self.__sections = []
+
+        sections = [(start, end, i, s)
+                    for i, (start, end, s) in enumerate(sections)
+                    if start < end]
+        bounds = sorted({b for sect in sections for b in sect[:2]})
+        sections.sort()
+
+        # heap of (order in the file, end, section)
+        active = []
+        j = 0
+
+        for k in range(len(bounds) - 1):
+            lo, hi = bounds[k], bounds[k+1]
+
+            while j < len(sections) and sections[j][0] <= lo:
+                start, end, i, s = sections[j]
+                heappush(active, (i, end, s))
+                j += 1
+
+            while active and active[0][1] <= lo:
+                heappop(active)
+
+            if not active:
+                continue
+
+            s = active[0][2]
+            if self.__sections and self.__sections[-1] is s and \
+                    self.__ends[-1] == lo:
+                self.__ends[-1] = hi
+            else:
+                self.__starts.append(lo)
+                self.__ends.append(hi)
+                self.__sections.append(s)
+
+
+    def find(self, addr):
+        i = bisect_right(self.__starts, addr) - 1
+        if i != -1 and addr < self.__ends[i]:
+            return self.__sections[i]
+        return None
+
+
+# Sorted index of the strings of a data section, built with one scan of
+# the section (the regexps are run on the mapped file).
+#
+# An ASCII string is a run of bytes until a null byte. An UTF-16LE
+# string is a run of (char, 0) until a null char, it's used only if
+# utf16 is True (PE). All runs are indexed, even those which contain
+# non printable chars : get_string can be called on any address.
+class StringIndex():
+    ASCII_RUN = re.compile(b"[^\\0]+")
+    UTF16_RUN = re.compile(b"(?:[^\\0]\\0)+")
+    PRINTABLE_RUN = re.compile(b"[\\t\\n\\r\\x20-\\x7e]+")
+
+    def __init__(self, data, utf16=False):
+        self.__data = data
+        self.__ascii = self.__scan(self.ASCII_RUN)
+        self.__utf16 = self.__scan(self.UTF16_RUN) if utf16 else None
+
+
+    def __scan(self, regex):
+        starts = []
+        ends = []
+        for m in regex.finditer(self.__data):
+            starts.append(m.start())
+            ends.append(m.end())
+        return starts, ends
+
+
+    def __len__(self):
+        n = len(self.__ascii[0])
+        if self.__utf16 is not None:
+            n += len(self.__utf16[0])
+        return n
+
+
+    # Returns the end of the run which contains off, or None
+    def __find(self, index, off):
+        starts, ends = index
+        i = bisect_right(starts, off) - 1
+        if i != -1 and off < ends[i]:
+            return ends[i]
+        return None
+
+
+    def __format(self, chars, truncated):
+        txt = ''.join(map(get_char, chars))
+        if truncated:
+            return '"' + txt + '..."'
+        return '"' + txt + '"'
+
+
+    def __get_utf16(self, off, max_size):
+        end = self.__find(self.__utf16, off)
+        if end is None or (off - end) % 2 != 0:
+            return None
+
+        n = (end - off) // 2
+        size = len(self.__data)
+
+        # Not terminated by a null char : the next char is read, and if
+        # there is still something after, it's an ASCII string.
+        if n < max_size and end < size and self.__data[end] != 0:
+            if n + 1 < max_size and end + 1 < size:
+                return None
+            n += 1
+
+        n = min(n, max_size)
+        return self.__format(self.__data[off:off + 2 * n:2],
+                             n == max_size and off + 2 * n - 1 != size)
+
+
+    # Returns the string at the offset off (with quotes), it's truncated
+    # to max_size chars.
+    def get_string(self, off, max_size):
+        if self.__utf16 is not None:
+            s = self.__get_utf16(off, max_size)
+            if s is not None:
+                return s
+
+        end = self.__find(self.__ascii, off)
+        if end is None:
+            end = off
+        n = min(end - off, max_size)
+
+        return self.__format(self.__data[off:off + n],
+                             n == max_size and off + n != len(self.__data))
+
+
+    # Yields (offset, string) for all strings which contain only
+    # printable chars, sorted by offset.
+    def iter_printable(self, min_len):
+        strings = []
+        starts, ends = self.__ascii
+        for i in range(len(starts)):
+            if ends[i] - starts[i] >= min_len and \
+                    self.PRINTABLE_RUN.fullmatch(self.__data, starts[i], ends[i]):
+                strings.append((starts[i], self.__data[starts[i]:ends[i]]))
+
+        if self.__utf16 is not None:
+            starts, ends = self.__utf16
+            for i in range(len(starts)):
+                if (ends[i] - starts[i]) // 2 < min_len:
+                    continue
+                chars = bytes(self.__data[starts[i]:ends[i]:2])
+                if self.PRINTABLE_RUN.fullmatch(chars):
+                    strings.append((starts[i], chars))
+            strings.sort()
+
+        for off, chars in strings:
+            yield off, self.__format(chars, False)
+
+
+# Binary.symbols and Binary.reverse_symbols are used like a dict, but the
+# symbols are loaded only when they are read (lookup, iteration...).
+#
+# Each set of symbols (static, dynamic) is loaded independently in its
+# own dict (parts). A lookup stops at the first set which contains the
+# key, a symbol is not supposed to be in two sets. If the keys are
+# addresses (by_addr), a set is loaded only if its range of addresses
+# can contain the key : a miss doesn't load the other sets. The symbols set from
+# outside of a loader (user symbols, PE stubs) are saved in another
+# dict : they have the priority and they are iterated at the end, like
+# in a dict where they would have been set after the loading.
+#
+# The keys can be kept in a sorted list (for the addresses in
+# reverse_symbols). It's built on the first call to sorted_keys and
+# then updated for each new key. floor_key uses a sorted list for each
+# set, so it only loads the sets which can contain the result.
+class SymbolsDict():
+    def __init__(self, binary, by_addr=False):
+        self.__binary = binary
+        self.__by_addr = by_addr
+        self.parts = []
+        self.__parts_sorted = []
+        self.__added = {}
+        self.__added_sorted = None
+        self.__sorted = None
+        self.is_loading = False
+
+
+    # Load the next set which can contain a key in [low, high]
+    def __load_next(self, low, high):
+        if self.__by_addr:
+            return self.__binary.load_next_symbols(low, high)
+        return self.__binary.load_next_symbols()
+
+
+    def __lookup(self, key):
+        if key in self.__added:
+            return True, self.__added[key]
+
+        i = 0
+        while True:
+            while i < len(self.parts):
+                p = self.parts[i]
+                if key in p:
+                    return True, p[key]
+                i += 1
+            if not self.__load_next(key, key):
+                return False, None
+
+
+    def __contains__(self, key):
+        return self.__lookup(key)[0]
+
+
+    def __getitem__(self, key):
+        found, val = self.__lookup(key)
+        if not found:
+            raise KeyError(key)
+        return val
+
+
+    def get(self, key, default=None):
+        found, val = self.__lookup(key)
+        return val if found else default
+
+
+    def __setitem__(self, key, val):
+        if self.is_loading:
+            self.parts[-1][key] = val
+            return
+
+        self.__added[key] = val
+
+        # All the symbols are already loaded if the index exists
+        for keys in (self.__sorted, self.__added_sorted):
+            if keys is not None:
+                i = bisect_left(keys, key)
+                if i == len(keys) or keys[i] != key:
+                    keys.insert(i, key)
+
+
+    def __merged(self):
+        while self.__binary.load_next_symbols():
+            pass
+        d = {}
+        for p in self.parts:
+            d.update(p)
+        d.update(self.__added)
+        return d
+
+
+    def __iter__(self):
+        return iter(self.__merged())
+
+
+    def __len__(self):
+        return len(self.__merged())
+
+
+    def items(self):
+        return self.__merged().items()
+
+
+    def sorted_keys(self):
+        if self.__sorted is None:
+            self.__sorted = sorted(self.__merged())
+        return self.__sorted
+
+
+    # Returns the greatest key in [low, key], or None
+    def floor_key(self, key, low=None):
+        while self.__load_next(low, key):
+            pass
+
+        if self.__added_sorted is None:
+            self.__added_sorted = sorted(self.__added)
+        while len(self.__parts_sorted) < len(self.parts):
+            self.__parts_sorted.append(
+                sorted(self.parts[len(self.__parts_sorted)]))
+
+        res = None
+        for keys in [self.__added_sorted] + self.__parts_sorted:
+            i = bisect_right(keys, key) - 1
+            if i != -1 and (res is None or keys[i] > res):
+                res = keys[i]
+
+        if res is None or (low is not None and res < low):
+            return None
+        return res
+
+
 class Binary(object):
-    def __init__(self, filename, raw_type=None, raw_base=None, raw_big_endian=None):
+    def __init__(self, filename, raw_type=None, raw_base=None, raw_big_endian=None,
+                 raw_map=None):
         self.__binary = None
-        self.reverse_symbols = {}
-        self.symbols = {}
+        self.reverse_symbols = SymbolsDict(self, by_addr=True)
+        self.symbols = SymbolsDict(self)
+        # address -> end of the symbol, only if its size is known. It's
+        # filled with the set of symbols.
+        self.symbols_end = {}
+        self.__sym_loaders = []
         self.type = None
+        self.__map_file(filename)
 
         if raw_type != None:
             import lib.fileformat.raw as LIB_RAW
-            self.__binary = LIB_RAW.Raw(filename, raw_type, raw_base, raw_big_endian)
+            self.__binary = LIB_RAW.Raw(self, raw_type, raw_base, raw_big_endian,
+                                        raw_map)
             self.type = T_BIN_RAW
             return
 
@@ -58,26 +365,82 @@ class Binary(object):
         debug__("Binary loaded in %fs" % elapsed)
 
 
+    # The file is mapped only once, the sections are read with slices of
+    # file_view (a memoryview) so nothing is copied and only the pages
+    # which are read are loaded. The mapping is private (ACCESS_COPY) :
+    # the file is never modified, but the view is writable and can be
+    # given to ctypes without a copy (see Disassembler.lazy_disasm).
+    def __map_file(self, filename):
+        self.__file = open(filename, "rb")
+        if os.fstat(self.__file.fileno()).st_size == 0:
+            self.__mmap = None
+            self.file_view = memoryview(bytearray())
+        else:
+            self.__mmap = mmap.mmap(self.__file.fileno(), 0,
+                                    access=mmap.ACCESS_COPY)
+            self.file_view = memoryview(self.__mmap)
+
+
+    # Nothing is loaded here, see SymbolsDict. Each set has the range
+    # [start, end[ of its addresses, or None if it's unknown.
     def load_extra(self):
+        self.__sym_loaders = [
+            ("static", self.__binary.load_static_sym, None),
+            ("dynamic", self.__binary.load_dyn_sym,
+             self.__binary.get_dyn_sym_range()),
+        ]
+
+
+    # Load the next set of symbols which can contain an address in
+    # [low, high] (None is not a bound). Returns False if there is no
+    # such set.
+    def load_next_symbols(self, low=None, high=None):
+        for k, (name, load, rng) in enumerate(self.__sym_loaders):
+            if rng is None or ((high is None or rng[0] <= high) and
+                               (low is None or low < rng[1])):
+                break
+        else:
+            return False
+
+        start = time.clock()
+
+        del self.__sym_loaders[k]
+        for d in (self.symbols, self.reverse_symbols):
+            d.parts.append({})
+            d.is_loading = True
+        try:
+            load()
+        finally:
+            self.symbols.is_loading = False
+            self.reverse_symbols.is_loading = False
+
+        elapsed = time.clock()
+        elapsed = elapsed - start
+        debug__("Found %d %s symbols in %fs" %
+                (len(self.symbols.parts[-1]), name, elapsed))
+        return True
+
+
+    # The data sections are loaded only when a string is read inside, it's
+    # a view on the mapped file.
+    def load_string_index(self, name, offset, size, utf16=False):
         start = time.clock()
 
-        self.__binary.load_static_sym()
-        self.__binary.load_dyn_sym()
-        self.__binary.load_data_sections()
+        idx = StringIndex(self.file_view[offset:offset + size], utf16)
 
         elapsed = time.clock()
         elapsed = elapsed - start
-        debug__("Found %d symbols in %fs" % (len(self.symbols), elapsed))
+        debug__("Data section %s indexed (%d bytes, %d strings) in %fs" %
+                (name, size, len(idx), elapsed))
+        return idx
 
 
     def load_magic(self, filename):
-        f = open(filename, "rb")
-        magic = f.read(8)
+        magic = bytes(self.file_view[:8])
         if magic.startswith(b"\x7fELF"):
             self.type = T_BIN_ELF
         elif magic.startswith(b"MZ"):
             self.type = T_BIN_PE
-        f.close()
 
 
     def is_data(self, addr):
@@ -92,6 +455,28 @@ class Binary(object):
         return self.__binary.check_addr(addr)
 
 
+    # Returns the symbol name at addr. If addr is inside a function,
+    # returns "func+0x1c" with the nearest symbol before addr in the same
+    # executable section, if addr is before the end of the symbol (when
+    # it's known). Returns None if there is no symbol.
+    def get_symbol_name(self, addr):
+        name = self.reverse_symbols.get(addr)
+        if name is not None:
+            return name
+
+        _, is_exec = self.check_addr(addr)
+        if not is_exec:
+            return None
+
+        ad = self.reverse_symbols.floor_key(addr,
+                                            self.get_section_meta(addr)[1])
+        if ad is None or addr >= self.symbols_end.get(ad, addr + 1):
+            return None
+
+        return self.reverse_symbols[ad] + "+" + hex(addr - ad)
+
+
+    # Returns a memoryview on the file (it can be empty)
     def section_stream_read(self, addr, size):
         return self.__binary.section_stream_read(addr, size)
 
@@ -100,6 +485,12 @@ class Binary(object):
         return self.__binary.get_string(addr, max_string_data)
 
 
+    # Yields (address, string) for the printable strings of the data
+    # sections
+    def iter_strings(self, min_len):
+        return self.__binary.iter_strings(min_len)
+
+
     def get_arch(self):
         return self.__binary.get_arch()
 
@@ -132,6 +523,10 @@ class Binary(object):
 
     # Only for PE !
     def pe_reverse_stripped_symbols(self, dis):
+        # The imported symbols are needed
+        while self.load_next_symbols():
+            pass
+
         start = time.clock()
 
         n = self.__binary.pe_reverse_stripped_symbols(dis)
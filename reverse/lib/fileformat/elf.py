@@ -17,10 +17,12 @@
 # along with this program.    If not, see <http://www.gnu.org/licenses/>.
 #
 
+import struct
+
 from elftools.elf.elffile import ELFFile
 from elftools.elf.constants import SH_FLAGS
 
-import lib.utils
+from lib.fileformat.binary import SectionIndex
 
 
 # SHF_WRITE=0x1
@@ -38,6 +40,31 @@ import lib.utils
 # SHF_MASKPROC=0xf0000000
 
 
+# The symbols and the relocations are read with struct, directly in the
+# mapped file (pyelftools is too slow with a lot of symbols). Other
+# classes use pyelftools.
+#
+# elfclass -> (format of Elf_Sym, index of st_value, index of st_size)
+SYM_FMT = {
+    32: ("IIIBBH", 1, 2), # name, value, size, info, other, shndx
+    64: ("IBBHQQ", 4, 5), # name, info, other, shndx, value, size
+}
+
+# (elfclass, is_rela) -> format of Elf_Rel(a), r_info is the second field
+REL_FMT = {
+    (32, False): "II",
+    (32, True):  "IIi",
+    (64, False): "QQ",
+    (64, True):  "QQq",
+}
+
+# elfclass -> shift to get the symbol index in r_info
+REL_SYM_SHIFT = {
+    32: 8,
+    64: 32,
+}
+
+
 class ELF:
     def __init__(self, classbinary, filename):
         import capstone as CAPSTONE
@@ -45,9 +72,17 @@ class ELF:
         fd = open(filename, "rb")
         self.elf = ELFFile(fd)
         self.classbinary = classbinary
-        self.__data_sections = []
-        self.__data_sections_content = []
-        self.__exec_sections = []
+        # Only sections which are mapped in memory. The index returns
+        # the position in this list (sections of pyelftools can't be
+        # used as keys).
+        self.__mapped_sections = [s for s in self.elf.iter_sections()
+                                  if s.header.sh_addr != 0]
+        self.__sections = SectionIndex(
+            [(s.header.sh_addr, s.header.sh_addr + s.header.sh_size, i)
+             for i, s in enumerate(self.__mapped_sections)])
+
+        # position -> StringIndex, built by get_string
+        self.__strings = {}
 
         self.arch_lookup = {
             "x86": CAPSTONE.CS_ARCH_X86,
@@ -67,15 +102,97 @@ class ELF:
         }
 
 
+    # Returns an iterator on the entries of the table s (tuples from
+    # struct), or None if the format is unknown.
+    def __iter_table(self, s, fmt):
+        fmt = ("<" if self.elf.little_endian else ">") + fmt
+        size = struct.calcsize(fmt)
+        off = s.header.sh_offset
+        data = self.classbinary.file_view[off:off + s.header.sh_size]
+        if s.header.sh_entsize != size or len(data) % size != 0:
+            return None
+        return struct.iter_unpack(fmt, data)
+
+
+    # The string table is read only for the names we keep
+    def __get_strtab(self, s):
+        strtab = self.elf.get_section(s.header.sh_link)
+        off = strtab.header.sh_offset
+        return bytes(self.classbinary.file_view[off:off + strtab.header.sh_size])
+
+
+    def __get_name(self, strtab, off):
+        end = strtab.find(b"\0", off)
+        if end == -1:
+            return strtab[off:]
+        return strtab[off:end]
+
+
     def load_static_sym(self):
         symtab = self.elf.get_section_by_name(b".symtab")
         if symtab is None:
             return
-        for sy in symtab.iter_symbols():
-            if sy.entry.st_value != 0 and sy.name != b"":
-                self.classbinary.reverse_symbols[sy.entry.st_value] = sy.name.decode()
-                self.classbinary.symbols[sy.name.decode()] = sy.entry.st_value
-            # print("%x\t%s" % (sy.entry.st_value, sy.name.decode()))
+
+        fmt = SYM_FMT.get(self.elf.elfclass, None)
+        it = None if fmt is None else self.__iter_table(symtab, fmt[0])
+
+        if it is None:
+            for sy in symtab.iter_symbols():
+                if sy.entry.st_value != 0 and sy.name != b"":
+                    self.classbinary.reverse_symbols[sy.entry.st_value] = sy.name.decode()
+                    self.classbinary.symbols[sy.name.decode()] = sy.entry.st_value
+                    if sy.entry.st_size != 0:
+                        self.classbinary.symbols_end[sy.entry.st_value] = \
+                            sy.entry.st_value + sy.entry.st_size
+                # print("%x\t%s" % (sy.entry.st_value, sy.name.decode()))
+            return
+
+        strtab = self.__get_strtab(symtab)
+        idx_value = fmt[1]
+        idx_size = fmt[2]
+        reverse_symbols = self.classbinary.reverse_symbols
+        symbols = self.classbinary.symbols
+        symbols_end = self.classbinary.symbols_end
+
+        for sy in it:
+            value = sy[idx_value]
+            if value == 0 or sy[0] == 0:
+                continue
+            name = self.__get_name(strtab, sy[0])
+            if name != b"":
+                name = name.decode()
+                reverse_symbols[value] = name
+                symbols[name] = value
+                if sy[idx_size] != 0:
+                    symbols_end[value] = value + sy[idx_size]
+
+
+    # Returns the list of the names of the symbols used by the relocations
+    # in rel (in the same order).
+    def __get_rel_sym_names(self, rel, dyn):
+        elfclass = self.elf.elfclass
+        is_rela = rel.header.sh_type == "SHT_RELA"
+        fmt_rel = REL_FMT.get((elfclass, is_rela), None)
+        fmt_sym = SYM_FMT.get(elfclass, None)
+
+        relitems = None
+        symitems = None
+        if fmt_rel is not None and fmt_sym is not None:
+            relitems = self.__iter_table(rel, fmt_rel)
+            symitems = self.__iter_table(dyn, fmt_sym[0])
+
+        if relitems is None or symitems is None:
+            dynsym = list(dyn.iter_symbols())
+            return [dynsym[r.entry.r_info_sym].name.decode()
+                    for r in rel.iter_relocations()]
+
+        # st_name is the first field, only the used names are read
+        st_names = [sy[0] for sy in symitems]
+        shift = REL_SYM_SHIFT[elfclass]
+        strtab = self.__get_strtab(dyn)
+
+        return [self.__get_name(strtab, st_names[r[1] >> shift]).decode()
+                for r in relitems]
 
 
     def load_dyn_sym(self):
@@ -104,8 +221,7 @@ class ELF:
         if arch == "MIPS":
             return
 
-        relitems = list(rel.iter_relocations())
-        dynsym = list(dyn.iter_symbols())
+        names = self.__get_rel_sym_names(rel, dyn)
 
         plt = self.elf.get_section_by_name(b".plt") 
         plt_entry_size = PLT_SIZE[arch]
@@ -114,78 +230,68 @@ class ELF:
         k = 0
 
         while off < plt.header.sh_addr + plt.header.sh_size :
-            idx = relitems[k].entry.r_info_sym
-            name = dynsym[idx].name.decode()
+            name = names[k]
             self.classbinary.reverse_symbols[off] = name + "@plt"
             self.classbinary.symbols[name + "@plt"] = off
+            self.classbinary.symbols_end[off] = off + plt_entry_size
             off += plt_entry_size
             k += 1
 
 
-    def load_data_sections(self):
-        for s in self.elf.iter_sections():
-            if self.__section_is_data(s):
-                self.__data_sections.append(s)
-                self.__data_sections_content.append(s.data())
+    # The @plt symbols are only in .plt
+    def get_dyn_sym_range(self):
+        plt = self.elf.get_section_by_name(b".plt")
+        if plt is None:
+            return (0, 0)
+        a = plt.header.sh_addr
+        return (a, a + plt.header.sh_size)
 
 
-    def __get_data_section_idx(self, addr):
-        for i, s in enumerate(self.__data_sections):
-            start = s.header.sh_addr
-            end = start + s.header.sh_size
-            if start <= addr < end:
-                return i
-        return -1
+    def __get_string_index(self, i):
+        idx = self.__strings.get(i, None)
+        if idx is None:
+            s = self.__mapped_sections[i]
+            idx = self.classbinary.load_string_index(
+                    s.name.decode(), s.header.sh_offset, s.header.sh_size)
+            self.__strings[i] = idx
+        return idx
 
 
-    def __section_is_data(self, s):
-        mask = SH_FLAGS.SHF_WRITE | SH_FLAGS.SHF_ALLOC
-        return s.header.sh_flags & mask and not self.__section_is_exec(s)
+    def __get_data_section(self, addr):
+        i = self.__sections.find(addr)
+        if i is None or not self.__section_is_data(self.__mapped_sections[i]):
+            return None
+        return i
 
 
-    def is_address(self, imm):
-        for s in self.elf.iter_sections():
-            start = s.header.sh_addr
-            if start == 0:
-                continue
-            end = start + s.header.sh_size
-            if  start <= imm < end:
-                return s.name.decode(), self.__section_is_data(s)
-        return None, False
+    def is_data(self, addr):
+        return self.__get_data_section(addr) is not None
 
 
-    def __get_cached_exec_section(self, addr):
-        for s in self.__exec_sections:
-            start = s.header.sh_addr
-            end = start + s.header.sh_size
-            if start <= addr < end:
-                return s
-        return None
+    def __section_is_data(self, s):
+        mask = SH_FLAGS.SHF_WRITE | SH_FLAGS.SHF_ALLOC
+        return s.header.sh_flags & mask and not self.__section_is_exec(s)
 
 
-    def __find_section(self, addr):
-        for s in self.elf.iter_sections():
-            start = s.header.sh_addr
-            end = start + s.header.sh_size
-            if  start <= addr < end:
-                return s
-        return None
+    def is_address(self, imm):
+        s = self.__get_section(imm)
+        if s is None:
+            return None, False
+        return s.name.decode(), self.__section_is_data(s)
 
 
     def __get_section(self, addr):
-        s = self.__get_cached_exec_section(addr)
-        if s is not None:
-            return s
-        s = self.__find_section(addr)
-        if s is None:
+        i = self.__sections.find(addr)
+        if i is None:
             return None
-        self.__exec_sections.append(s)
-        return s
+        return self.__mapped_sections[i]
 
 
     def check_addr(self, addr):
         s = self.__get_section(addr)
-        return (s is not None, self.__section_is_exec(s))
+        if s is None:
+            return (False, False)
+        return (True, self.__section_is_exec(s))
 
 
     def get_section_meta(self, addr):
@@ -199,11 +305,10 @@ class ELF:
     def section_stream_read(self, addr, size):
         s = self.__get_section(addr)
         if s is None:
-            return b""
-        off = addr - s.header.sh_addr
+            return self.classbinary.file_view[0:0]
+        off = s.header.sh_offset + addr - s.header.sh_addr
         end = s.header.sh_addr + s.header.sh_size
-        s.stream.seek(s.header.sh_offset + off)
-        return s.stream.read(min(size, end - addr))
+        return self.classbinary.file_view[off:off + min(size, end - addr)]
 
 
     def __section_is_exec(self, s):
@@ -211,29 +316,25 @@ class ELF:
 
 
     def get_string(self, addr, max_data_size):
-        i = self.__get_data_section_idx(addr)
-        if i == -1:
+        i = self.__get_data_section(addr)
+        if i is None:
             return ""
-
-        s = self.__data_sections[i]
-        data = self.__data_sections_content[i]
+        s = self.__mapped_sections[i]
+        # No bytes in the file, the section is filled with zeros
+        if s.header.sh_type == "SHT_NOBITS":
+            return '""'
         off = addr - s.header.sh_addr
-        txt = ['"']
-
-        i = 0
-        while i < max_data_size and \
-              off < s.header.sh_size:
-            c = data[off]
-            if c == 0:
-                break
-            txt.append(lib.utils.get_char(c))
-            off += 1
-            i += 1
-
-        if c != 0 and off != s.header.sh_size:
-            txt.append("...")
-
-        return ''.join(txt) + '"'
+        return self.__get_string_index(i).get_string(off, max_data_size)
+
+
+    def iter_strings(self, min_len):
+        for i, s in enumerate(self.__mapped_sections):
+            if s.header.sh_type == "SHT_NOBITS" or \
+                    not self.__section_is_data(s):
+                continue
+            a = s.header.sh_addr
+            for off, txt in self.__get_string_index(i).iter_printable(min_len):
+                yield a + off, txt
 
 
     def get_arch(self):
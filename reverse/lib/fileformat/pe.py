@@ -18,13 +18,23 @@
 #
 
 
+import struct
 import pefile
+from bisect import bisect_right
+from itertools import islice
 from capstone.x86 import X86_OP_INVALID, X86_OP_IMM, X86_OP_MEM
-from ctypes import sizeof
 
-from lib.utils import get_char
 from lib.exceptions import ExcPEFail
-from lib.fileformat.pefile2 import PE2, SymbolEntry
+from lib.fileformat.binary import SectionIndex
+
+
+# COFF symbol : name (or zeroes + offset in the string table), value,
+# scnum, type, sclass, numaux. The aux records have the same size.
+SYM_FMT = "<8sIhHBB"
+SYM_SIZE = struct.calcsize(SYM_FMT)
+
+# Type of a function (complex type in the bits 4-5)
+SYM_DTYPE_FUNCTION = 2
 
 
 class PE:
@@ -32,11 +42,14 @@ class PE:
         import capstone as CAPSTONE
 
         self.classbinary = classbinary
-        self.pe = PE2(filename, fast_load=True)
-        self.__data_sections = []
-        self.__data_sections_content = []
-        self.__exec_sections = []
+        self.pe = pefile.PE(filename, fast_load=True)
+        self.__strings = {} # section -> StringIndex, built by get_string
         self.__imported_syms = {}
+        # Number of instructions in dis.code_addrs already examined by
+        # pe_reverse_stripped_symbols
+        self.__code_examined = 0
+
+        self.__sections = SectionIndex(self.__get_intervals())
 
         self.arch_lookup = {
             # See machine_types in pefile.py
@@ -51,40 +64,85 @@ class PE:
         }
 
 
+    # Like pefile.get_section_by_rva, a section can be bigger than its data
+    # in the file (filled with zeros) but it stops at the next section.
+    def __get_intervals(self):
+        base = self.pe.OPTIONAL_HEADER.ImageBase
+        sections = self.pe.sections
+        intervals = []
+
+        for i, s in enumerate(sections):
+            start = s.VirtualAddress
+            end = start + max(s.SizeOfRawData, s.Misc_VirtualSize)
+            if i + 1 < len(sections):
+                nxt = sections[i + 1].VirtualAddress
+                if start < nxt < end:
+                    end = nxt
+            intervals.append((base + start, base + end, s))
+
+        return intervals
+
+
     def load_static_sym(self):
         # http://wiki.osdev.org/COFF
         # http://www.delorie.com/djgpp/doc/coff/symtab.html
 
+        data = self.classbinary.file_view
         sym_table_off = self.pe.FILE_HEADER.PointerToSymbolTable
         n_sym = self.pe.FILE_HEADER.NumberOfSymbols
-        string_table_off = sym_table_off + sizeof(SymbolEntry) * n_sym
+        string_table_off = sym_table_off + SYM_SIZE * n_sym
         base = self.pe.OPTIONAL_HEADER.ImageBase + \
                self.pe.OPTIONAL_HEADER.SectionAlignment
 
-        off = sym_table_off
-        i = 0
-
-        while i < n_sym:
-            sym = self.pe.get_sym_at_offset(off)
+        # The table is unpacked directly from the mapped file
+        table = data[sym_table_off:string_table_off]
+        n_sym = min(n_sym, len(table) // SYM_SIZE)
+        it = struct.iter_unpack(SYM_FMT, table[:n_sym * SYM_SIZE])
+        strtab = None
+
+        # The COFF symbols have no size : a function ends at the next
+        # function of its section (the static ones are not loaded but
+        # they are in the table).
+        # scnum -> start addresses of the functions
+        func_starts = {}
+        funcs = []
+
+        for name, value, scnum, typ, sclass, numaux in it:
+            is_func = (typ >> 4) & 3 == SYM_DTYPE_FUNCTION and scnum > 0
+            if is_func:
+                func_starts.setdefault(scnum, []).append(value)
+
+            if sclass == 2:  # static symbol
+                if name[:4] != b"\0\0\0\0":
+                    name = name.split(b"\0", 1)[0].decode()
+                else:
+                    if strtab is None:
+                        strtab = bytes(data[string_table_off:])
+                    i = struct.unpack_from("<I", name, 4)[0]
+                    j = strtab.find(b"\0", i)
+                    if j == -1:
+                        j = len(strtab)
+                    name = strtab[i:j].decode()
 
-            if sym.sclass == 2:  # static symbol
-                name = \
-                    sym.sym.name.decode() if sym.sym.addr.zeroes != 0 else \
-                    self.pe.get_string_at_offset(string_table_off + \
-                                                 sym.sym.addr.offset)
+                # print("%d   %s" % (scnum, name))
 
-                # print("%d   %s" % (sym.scnum, name))
+                self.classbinary.reverse_symbols[value + base] = name
+                self.classbinary.symbols[name] = value + base
+                if is_func:
+                    funcs.append((scnum, value))
 
-                self.classbinary.reverse_symbols[sym.value + base] = name
-                self.classbinary.symbols[name] = sym.value + base
-                
-            if sym.numaux != 0:
-                off += sym.numaux * sizeof(SymbolEntry)
-                i += sym.numaux
+            # The aux records are skipped
+            if numaux:
+                next(islice(it, numaux - 1, None), None)
 
-            off += sizeof(SymbolEntry)
-            i += 1
+        for starts in func_starts.values():
+            starts.sort()
 
+        for scnum, value in funcs:
+            starts = func_starts[scnum]
+            i = bisect_right(starts, value)
+            if i < len(starts):
+                self.classbinary.symbols_end[value + base] = starts[i] + base
 
 
     def load_dyn_sym(self):
@@ -101,6 +159,27 @@ class PE:
                 self.classbinary.symbols[imp.name] = imp.address
 
 
+    # The imported symbols are in the IAT. If its directory is empty
+    # (mingw), they are in the section of the import directory.
+    def get_dyn_sym_range(self):
+        base = self.pe.OPTIONAL_HEADER.ImageBase
+        dirs = self.pe.OPTIONAL_HEADER.DATA_DIRECTORY
+
+        d = dirs[pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_IAT']]
+        if d.Size != 0:
+            return (base + d.VirtualAddress,
+                    base + d.VirtualAddress + d.Size)
+
+        d = dirs[pefile.DIRECTORY_ENTRY['IMAGE_DIRECTORY_ENTRY_IMPORT']]
+        if d.Size == 0:
+            return (0, 0)
+        s = self.pe.get_section_by_rva(d.VirtualAddress)
+        if s is None:
+            return None
+        start = base + s.VirtualAddress
+        return (start, start + max(s.Misc_VirtualSize, s.SizeOfRawData))
+
+
     def pe_reverse_stripped_symbols(self, dis):
         def inv(n):
             return n == X86_OP_INVALID
@@ -116,10 +195,13 @@ class PE:
         # we have "call ADDRESS" and not "call SYMBOL"
         #
 
-        # Search in the code every call which point to a "jmp SYMBOL"
+        # Search in the code every call which point to a "jmp SYMBOL".
+        # Only the instructions disassembled since the last call are
+        # examined.
 
         ARCH_UTILS = dis.load_arch_module().utils
-        k = list(dis.code.keys())
+        k = dis.code_addrs[self.__code_examined:]
+        self.__code_examined += len(k)
         count = 0
 
         for ad in k:
@@ -153,11 +235,15 @@ class PE:
         return count
 
 
-    def load_data_sections(self):
-        for s in self.pe.sections:
-            if self.__section_is_data(s):
-                self.__data_sections.append(s)
-                self.__data_sections_content.append(s.get_data())
+    def __get_string_index(self, s):
+        idx = self.__strings.get(s, None)
+        if idx is None:
+            # Same offset as in section_stream_read
+            off = s.get_offset_from_rva(s.VirtualAddress)
+            idx = self.classbinary.load_string_index(
+                    s.Name.decode().rstrip(' \0'), off, s.SizeOfRawData, True)
+            self.__strings[s] = idx
+        return idx
 
 
     def __section_is_data(self, s):
@@ -167,50 +253,29 @@ class PE:
 
 
     def is_data(self, addr):
-        base = self.pe.OPTIONAL_HEADER.ImageBase
-        for s in self.__data_sections:
-            start = base + s.VirtualAddress
-            end = start + s.SizeOfRawData
-            if start <= addr < end:
-                return True
-        return False
+        return self.__get_data_section(addr) is not None
 
 
+    # Returns the data section only if addr is in the raw data
     def __get_data_section(self, addr):
+        s = self.__sections.find(addr)
+        if s is None or not self.__section_is_data(s):
+            return None
         base = self.pe.OPTIONAL_HEADER.ImageBase
-        for i, s in enumerate(self.__data_sections):
-            start = base + s.VirtualAddress
-            end = start + s.SizeOfRawData
-            if start <= addr < end:
-                return i
-        return -1
-
-
-    def __get_cached_exec_section(self, addr):
-        base = self.pe.OPTIONAL_HEADER.ImageBase
-        for s in self.__exec_sections:
-            start = base + s.VirtualAddress
-            end = start + s.SizeOfRawData
-            if start <= addr < end:
-                return s
-        return None
+        if addr >= base + s.VirtualAddress + s.SizeOfRawData:
+            return None
+        return s
 
 
     def __get_section(self, addr):
-        s = self.__get_cached_exec_section(addr)
-        if s is not None:
-            return s
-        base = self.pe.OPTIONAL_HEADER.ImageBase
-        s = self.pe.get_section_by_rva(addr - base)
-        if s is None:
-            return None
-        self.__exec_sections.append(s)
-        return s
+        return self.__sections.find(addr)
 
 
     def check_addr(self, addr):
         s = self.__get_section(addr)
-        return (s is not None, self.__section_is_exec(s))
+        if s is None:
+            return (False, False)
+        return (True, self.__section_is_exec(s))
 
 
     def get_section_meta(self, addr):
@@ -224,18 +289,23 @@ class PE:
 
     def section_stream_read(self, addr, size):
         s = self.__get_section(addr)
+        view = self.classbinary.file_view
         if s is None:
-            return b""
+            return view[0:0]
         base = self.pe.OPTIONAL_HEADER.ImageBase
-        off = addr - base
         end = base + s.VirtualAddress + s.SizeOfRawData
-        return s.get_data(off, min(size, end - addr))
+        if addr >= end:
+            return view[0:0]
+        # Same offsets as pefile.SectionStructure.get_data
+        off = s.get_offset_from_rva(addr - base)
+        off_end = min(off + min(size, end - addr),
+                      s.PointerToRawData + s.SizeOfRawData)
+        return view[off:off_end]
 
 
     def is_address(self, imm):
-        base = self.pe.OPTIONAL_HEADER.ImageBase
-        if imm > base:
-            s = self.pe.get_section_by_rva(imm - base)
+        if imm > self.pe.OPTIONAL_HEADER.ImageBase:
+            s = self.__sections.find(imm)
             if s is not None:
                 return s.Name.decode().rstrip(' \0'), self.__section_is_data(s)
         return None, False
@@ -245,38 +315,22 @@ class PE:
         return s.Characteristics & 0x20000000
 
 
-    def get_string(self, addr, max_data_size, may_be_utf16le=True):
-        i = self.__get_data_section(addr)
-        if i == -1:
+    def get_string(self, addr, max_data_size):
+        s = self.__get_data_section(addr)
+        if s is None:
             return ""
+        off = addr - s.VirtualAddress - self.pe.OPTIONAL_HEADER.ImageBase
+        return self.__get_string_index(s).get_string(off, max_data_size)
 
-        s = self.__data_sections[i]
-        data = self.__data_sections_content[i]
-        base = self.pe.OPTIONAL_HEADER.ImageBase
-        off = addr - s.VirtualAddress - base
-        txt = ['"']
-
-        i = 0
-        skipped = 0
-        while i - skipped < max_data_size and \
-              off < s.SizeOfRawData:
-            c = data[off]
-            if c == 0:
-                if may_be_utf16le and i % 2 == 1:
-                    skipped += 1
-                else:
-                    break
-            else:
-                if may_be_utf16le and i % 2 == 1:
-                    return self.get_string(addr, max_data_size, False)
-                txt.append(get_char(c))
-            off += 1
-            i += 1
-
-        if c != 0 and off != s.SizeOfRawData:
-            txt.append("...")
 
-        return ''.join(txt) + '"'
+    def iter_strings(self, min_len):
+        base = self.pe.OPTIONAL_HEADER.ImageBase
+        for s in self.pe.sections:
+            if not self.__section_is_data(s):
+                continue
+            a = base + s.VirtualAddress
+            for off, txt in self.__get_string_index(s).iter_printable(min_len):
+                yield a + off, txt
 
 
     def get_arch(self):
@@ -17,16 +17,77 @@
 # along with this program.    If not, see <http://www.gnu.org/licenses/>.
 #
 
+from lib.utils import warning
+from lib.exceptions import ExcRawMap
+from lib.fileformat.binary import SectionIndex
+
+
+class Segment():
+    def __init__(self, name, offset, size, addr, is_exec):
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.addr = addr
+        self.is_exec = is_exec
+
+
+# The segments of a raw file are read from a map file (option --rawmap).
+# One segment per line :
+#
+#     NAME OFFSET_HEXA SIZE_HEXA ADDRESS_HEXA [x]
+#
+# x is set if the segment is executable. Empty lines and lines which
+# start with # are ignored. A segment is cut at the end of the file, a
+# segment which starts after the end is skipped.
+def load_raw_map(filename, file_size):
+    segments = []
+
+    with open(filename) as fd:
+        for n, l in enumerate(fd, 1):
+            arg = l.split()
+            if not arg or arg[0].startswith("#"):
+                continue
+
+            if len(arg) not in (4, 5) or (len(arg) == 5 and arg[4] != "x"):
+                raise ExcRawMap(filename, n)
+
+            try:
+                offset, size, addr = (int(a, 16) for a in arg[1:4])
+            except ValueError:
+                raise ExcRawMap(filename, n)
+
+            if offset >= file_size:
+                warning("%s:%d: segment %s is after the end of the file, "
+                        "skipped" % (filename, n, arg[0]))
+                continue
+
+            size = min(size, file_size - offset)
+            segments.append(Segment(arg[0], offset, size, addr, len(arg) == 5))
+
+    return segments
+
 
 class Raw:
-    def __init__(self, filename, raw_type, raw_base, raw_big_endian):
+    def __init__(self, classbinary, raw_type, raw_base, raw_big_endian,
+                 raw_map=None):
         import capstone as CAPSTONE
 
-        self.raw = open(filename, "rb").read()
+        self.classbinary = classbinary
+        self.raw = classbinary.file_view
         self.raw_type = raw_type
         self.raw_base = raw_base
         self.raw_big_endian = raw_big_endian
 
+        # Without a map, the whole file is one executable segment
+        if raw_map is None:
+            self.__segments = [Segment("raw", 0, len(self.raw), raw_base, True)]
+        else:
+            self.__segments = load_raw_map(raw_map, len(self.raw))
+        self.__has_map = raw_map is not None
+
+        self.__sections = SectionIndex(
+            [(s.addr, s.addr + s.size, s) for s in self.__segments])
+
         self.arch_lookup = {
             "x86": CAPSTONE.CS_ARCH_X86,
             "x64": CAPSTONE.CS_ARCH_X86,
@@ -52,37 +113,55 @@ class Raw:
         return
 
 
-    def load_data_sections(self):
-        return
+    def get_dyn_sym_range(self):
+        return (0, 0)
 
 
+    # Immediates are shown as addresses only if the segments are given,
+    # otherwise every small value would be in the default segment.
     def is_address(self, imm):
-        return None, False
+        if not self.__has_map:
+            return None, False
+        s = self.__sections.find(imm)
+        if s is None:
+            return None, False
+        return s.name, False
+
+
+    def is_data(self, addr):
+        return False
 
 
     def get_section_meta(self, addr):
-        return "raw", self.raw_base, self.raw_base + len(self.raw) - 1
+        s = self.__sections.find(addr)
+        if s is None:
+            return None
+        return s.name, s.addr, s.addr + s.size - 1
 
 
     def check_addr(self, addr):
-        ad = addr - self.raw_base
-        if ad >= len(self.raw) or ad < 0:
+        s = self.__sections.find(addr)
+        if s is None:
             return (False, False)
-        return (True, True)
+        return (True, s.is_exec)
 
 
     def section_stream_read(self, addr, size):
-        ad = addr - self.raw_base
-        if ad >= len(self.raw) or ad < 0:
-            return b""
-        end = self.raw_base + len(self.raw)
-        return self.raw[ad:ad + min(size, end - ad)]
+        s = self.__sections.find(addr)
+        if s is None:
+            return self.raw[0:0]
+        off = s.offset + addr - s.addr
+        return self.raw[off:min(off + size, s.offset + s.size)]
 
 
-    def get_string(self, addr):
+    def get_string(self, addr, max_data_size):
         return ""
 
 
+    def iter_strings(self, min_len):
+        return []
+
+
     def get_arch(self):
         import capstone as CAPSTONE
         arch = self.arch_lookup.get(self.raw_type, None)
@@ -95,16 +174,27 @@ class Raw:
 
 
     def section_start(self, section_name):
-        return 0
+        # Without a map the file starts at 0
+        if not self.__has_map:
+            return 0
+        for s in self.__segments:
+            if s.name == section_name.decode():
+                return s.addr
+        return -1
 
 
     def get_arch_string(self):
         return ""
 
 
+    # The first executable segment
     def get_entry_point(self):
-        return 0
+        for s in self.__segments:
+            if s.is_exec:
+                return s.addr
+        return self.raw_base
 
 
     def iter_sections(self):
-        return []
+        for s in self.__segments:
+            yield (s.name, s.addr, s.addr + s.size)
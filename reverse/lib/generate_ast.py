@@ -20,9 +20,9 @@
 import time
 
 from lib.ast import (Ast_Branch, Ast_Comment, Ast_Goto, Ast_Loop,
-        Ast_IfGoto, Ast_Ifelse, Ast_AndIf)
-from lib.utils import BRANCH_NEXT, BRANCH_NEXT_JUMP, debug__
-from lib.exceptions import ExcIfelse
+        Ast_IfGoto, Ast_Ifelse, Ast_AndIf, Ast_Walker)
+from lib.utils import BRANCH_NEXT, BRANCH_NEXT_JUMP, debug__, trampoline
+from lib.exceptions import ExcIfelse, ExcLimit
 
 
 def get_ast_ifgoto(ctx, paths, curr_loop_idx, inst):
@@ -77,6 +77,10 @@ def get_ast_ifgoto(ctx, paths, curr_loop_idx, inst):
     return Ast_IfGoto(inst, cond_id, br, prefetch)
 
 
+# get_ast_branch, get_ast_loop and get_ast_ifelse are generators, they
+# are run with lib.utils.trampoline to not depend on the recursion limit.
+# A sub-call is done with : ret = yield func(...)
+
 def get_ast_branch(ctx, paths, curr_loop_idx=[], last_else=-1):
     ast = Ast_Branch()
     is_if_printed = False
@@ -85,6 +89,9 @@ def get_ast_branch(ctx, paths, curr_loop_idx=[], last_else=-1):
         return ast
 
     while 1:
+        if ctx.deadline and time.time() > ctx.deadline:
+            raise ExcLimit("time", ctx.gph.nb_paths, len(ctx.gph.loops))
+
         ad = paths.first()
         if ad in ctx.seen:
             ast.add(Ast_Goto(ad))
@@ -131,10 +138,10 @@ def get_ast_branch(ctx, paths, curr_loop_idx=[], last_else=-1):
         if is_loop:
             # last_else == -1
             # -> we can't go to a same else inside a loop
-            a, endpoint = get_ast_loop(ctx, paths, curr_loop_idx, -1)
+            a, endpoint = yield get_ast_loop(ctx, paths, curr_loop_idx, -1)
             ast.add(a)
         elif is_ifelse:
-            a, endpoint = get_ast_ifelse(
+            a, endpoint = yield get_ast_ifelse(
                                ctx, paths, curr_loop_idx,
                                last_else, is_if_printed)
             is_if_printed = isinstance(a, Ast_Ifelse)
@@ -151,12 +158,13 @@ def get_ast_branch(ctx, paths, curr_loop_idx=[], last_else=-1):
 # TODO move in class Paths
 # Assume that the beginning of paths is the beginning of a loop
 def paths_is_infinite(paths):
+    all_addr = paths.addr_set()
     for k, p in paths.paths.items():
         for addr in p:
             if addr in paths.gph.cond_jumps_set:
                 nxt = paths.gph.link_out[addr]
-                if nxt[BRANCH_NEXT] not in paths or \
-                   nxt[BRANCH_NEXT_JUMP] not in paths: \
+                if nxt[BRANCH_NEXT] not in all_addr or \
+                   nxt[BRANCH_NEXT_JUMP] not in all_addr: \
                     return False
     return True
 
@@ -183,7 +191,7 @@ def get_ast_loop(ctx, paths, last_loop_idx, last_else):
 
     addr = loop_paths.pop(1)[0]
     ctx.seen.add(addr)
-    ast.add(get_ast_branch(ctx, loop_paths, curr_loop_idx))
+    ast.add((yield get_ast_branch(ctx, loop_paths, curr_loop_idx)))
 
     if not loopends:
         return ast, -1
@@ -201,7 +209,7 @@ def get_ast_loop(ctx, paths, last_loop_idx, last_else):
                 epilog.add(Ast_Comment("loopend " + str(epilog_num)))
                 epilog_num += 1
 
-            epilog.add(get_ast_branch(ctx, el, last_loop_idx))
+            epilog.add((yield get_ast_branch(ctx, el, last_loop_idx)))
 
         if loopends[-1].first() in loopends_start:
             epilog.add(Ast_Comment("loopend " + str(epilog_num)))
@@ -316,11 +324,11 @@ def get_ast_ifelse(ctx, paths, curr_loop_idx, last_else, is_if_printed):
 
     if split[BRANCH_NEXT_JUMP].next_addr == else_addr:
         a1 = Ast_Branch()
-        a2 = get_ast_branch(ctx, split[BRANCH_NEXT], curr_loop_idx, else_addr)
+        a2 = yield get_ast_branch(ctx, split[BRANCH_NEXT], curr_loop_idx, else_addr)
         return (Ast_Ifelse(jump_inst, a1, a2, prefetch), else_addr)
 
-    a1 = get_ast_branch(ctx, split[BRANCH_NEXT_JUMP], curr_loop_idx, -1)
-    a2 = get_ast_branch(ctx, split[BRANCH_NEXT], curr_loop_idx, else_addr)
+    a1 = yield get_ast_branch(ctx, split[BRANCH_NEXT_JUMP], curr_loop_idx, -1)
+    a2 = yield get_ast_branch(ctx, split[BRANCH_NEXT], curr_loop_idx, else_addr)
     return (Ast_Ifelse(jump_inst, a1, a2, prefetch), endpoint)
 
 
@@ -330,24 +338,57 @@ def generate_ast(ctx__, paths):
 
     start = time.clock()
 
-    ast = get_ast_branch(ctx, paths)
+    ast = trampoline(get_ast_branch(ctx, paths))
 
     elapsed = time.clock()
     elapsed = elapsed - start
     debug__("Ast generated in %fs" % elapsed)
 
-    # Process ast
+    return process_ast(ctx, ast)
 
-    start = time.clock()
 
-    for func in ctx.libarch.registered:
-        func(ctx, ast)
+# Used when the function is too big (see ExcLimit) : the blocks are
+# printed in the order of the addresses, with a goto if the next block
+# is not the following one.
+def generate_ast_flat(ctx, gph):
+    ARCH_UTILS = ctx.libarch.utils
+    ast = Ast_Branch()
+    blocks = sorted(gph.nodes)
+
+    for i, ad in enumerate(blocks):
+        blk = gph.nodes[ad]
+        nxt = gph.link_out.get(ad, [])
+        following = blocks[i+1] if i+1 < len(blocks) else -1
+
+        if len(nxt) == 2:
+            prefetch = blk[1] if len(blk) == 2 else None
+            inst = blk[0]
+            ast.add(Ast_IfGoto(inst, ARCH_UTILS.get_cond(inst),
+                               nxt[BRANCH_NEXT_JUMP], prefetch))
+        else:
+            ast.add(blk)
 
-    elapsed = time.clock()
-    elapsed = elapsed - start
-    debug__("Functions for processing ast in %fs" % elapsed)
+        if nxt and nxt[BRANCH_NEXT] != following and \
+                ad not in gph.uncond_jumps_set:
+            ast.add(Ast_Goto(nxt[BRANCH_NEXT]))
 
+    return process_ast(ctx, ast)
+
+
+# Run all registered passes of the architecture on the ast, and the colors
+# at the end. This is common for all structuring algorithms. The ast is
+# walked only once for all passes, the colors have their own walk : they
+# are picked in the else-part before the if-part.
+def process_ast(ctx, ast):
+    start = time.clock()
+
+    passes = [p(ctx) for p in ctx.libarch.registered]
+    Ast_Walker(passes).walk(ast)
     if ctx.color:
         ctx.libarch.process_ast.assign_colors(ctx, ast)
 
+    elapsed = time.clock()
+    elapsed = elapsed - start
+    debug__("Passes on the ast (%d) in %fs" % (len(passes), elapsed))
+
     return ast
@@ -20,8 +20,11 @@
 import os
 import time
 
-from lib.paths import Paths
-from lib.utils import BRANCH_NEXT, BRANCH_NEXT_JUMP, index, debug__
+from lib.paths import Paths, Path
+from lib.loops import LoopForest
+from lib.dominator import compute_ipdom
+from lib.utils import BRANCH_NEXT, BRANCH_NEXT_JUMP, debug__
+from lib.exceptions import ExcLimit
 
 
 class Graph:
@@ -38,10 +41,22 @@ class Graph:
         
         self.link_in = {}
 
+        # Blocks are renumbered with dense integers, used by Path
+        self.addr_id = {}
+        self.id_addr = []
+
         self.entry_point_addr = entry_point_addr
         self.dis = dis
         self.loops = []
+
+        # Sets are bitmasks (int) : loops_set are over the block ids
+        # (see addr_id), nested_loops_idx and marked are over the loop
+        # indexes. An int can't be modified in place, so a set can be
+        # shared without risk.
         self.loops_set = []
+        self.loops_by_start = {} # start address -> list of loop idx
+        self.loop_forest = None
+        self.ipdom = None
         self.nested_loops_idx = {}
         self.direct_nested_idx = {}
 
@@ -52,113 +67,75 @@ class Graph:
         # If a loop is "marked" it means that there is an other equivalent
         # loop, and this must not be interpreted during the process. Generally
         # it will print a jmp. This can occurs if a goto jump inside a loop.
-        self.marked = set()
+        self.marked = 0
 
         # address juste before the loop marked
         self.marked_addr = set()
 
         self.__key_path_count = 0
-
-
-    # A jump is normally alone in a block, but for some architectures
-    # we save the prefetched instruction after.
-
-
-    def add_node(self, inst, prefetch=None):
-        self.nodes[inst.address] = [inst]
-        if prefetch is not None:
-            self.nodes[inst.address].append(prefetch)
-
-
-    def set_next(self, curr, inst, prefetch=None):
-        self.nodes[curr.address] = [curr]
-        self.link_out[curr.address] = [inst.address]
-
-        if inst.address not in self.link_in:
-            self.link_in[inst.address] = []
-        self.link_in[inst.address].append(curr.address)
-
-        if prefetch is not None:
-            self.nodes[curr.address].append(prefetch)
-
-
-    def set_cond_next(self, curr, next_jump, direct_next, prefetch=None):
-        self.nodes[curr.address] = [curr]
-        self.link_out[curr.address] = [direct_next.address, next_jump.address]
-
-        if next_jump.address not in self.link_in:
-            self.link_in[next_jump.address] = []
-
-        if direct_next.address not in self.link_in:
-            self.link_in[direct_next.address] = []
-
-        self.link_in[next_jump.address].append(curr.address)
-        self.link_in[direct_next.address].append(curr.address)
-
-        if prefetch is not None:
-            self.nodes[curr.address].append(prefetch)
-
-
-    def exists(self, inst):
-        return inst.address in self.nodes
-
-
-    def get_paths(self):
-        self.__simplify()
+        self.nb_paths = 0
+
+        # Limits for the exploration, 0 = no limit (see get_paths)
+        self.__max_paths = 0
+        self.__max_loops = 0
+        self.__deadline = 0
+
+
+    def add_block(self, blk, nxt):
+        ad = blk[0].address
+        self.nodes[ad] = blk
+        self.addr_id[ad] = len(self.id_addr)
+        self.id_addr.append(ad)
+        if not nxt:
+            return
+        self.link_out[ad] = nxt
+        for n in nxt:
+            if n not in self.link_in:
+                self.link_in[n] = []
+            self.link_in[n].append(ad)
+
+
+    # Raises ExcLimit if there are more than max_paths paths, more
+    # than max_loops loops or if the time is over the deadline (a
+    # time.time() value).
+    def get_paths(self, max_paths=0, max_loops=0, deadline=0):
+        self.__max_paths = max_paths
+        self.__max_loops = max_loops
+        self.__deadline = deadline
         paths = self.__explore(self.entry_point_addr)
         self.__search_equivalent_loops(paths)
         self.__compute_nested()
         return paths
 
 
-    # Concat instructions in single block
-    # jumps are in separated blocks
-    def __simplify(self):
-        ARCH_UTILS = self.dis.load_arch_module().utils
-        nodes = list(self.nodes.keys())
-        start = time.clock()
-
-        for ad in nodes:
-            inst = self.nodes[ad]
-            if ARCH_UTILS.is_jump(inst[0]):
-                continue
-
-            if ad not in self.link_in or len(self.link_in[ad]) != 1 or \
-                    ad == self.entry_point_addr:
-                continue
-
-            pred = self.link_in[ad][0]
-
-            # don't fuse with jumps
-            if ARCH_UTILS.is_jump(self.nodes[pred][0]):
-                continue
-
-            if pred not in self.link_out or len(self.link_out[pred]) != 1:
-                continue
-
-            if ad in self.link_out:
-                self.link_out[pred] = self.link_out[ad]
-            else:
-                del self.link_out[pred]
-
-            self.nodes[pred] += self.nodes[ad]
-
-            if ad in self.link_out:
-                del self.link_out[ad]
-
-            del self.link_in[ad]
-            del self.nodes[ad]
-
-            # replace all addr wich refers to ad
-            for k, lst_i in self.link_in.items():
-                try:
-                    lst_i[lst_i.index(ad)] = pred
-                except ValueError:
-                    pass
-
-        elapsed = time.clock()
-        elapsed = elapsed - start
-        debug__("Graph simplified in %fs" % elapsed)
+    # Immediate post-dominator of each block, computed once. A block
+    # which is only post-dominated by the end of the function is not in
+    # the dict (or if it can't reach the end : infinite loop).
+    #
+    # Only used by --dominators (lib/structure.py). The paths are cut at
+    # the loops and at the gotos, so Paths.first_common doesn't always
+    # give the ipdom (about a third of the if/else of the tests).
+    def get_ipdom(self):
+        if self.ipdom is None:
+            start = time.clock()
+            self.ipdom = compute_ipdom(self.nodes, self.link_out)
+            elapsed = time.clock()
+            elapsed = elapsed - start
+            debug__("Post-dominators computed in %fs" % elapsed)
+        return self.ipdom
+
+
+    # Only used by --dominators. get_paths still finds its own loops :
+    # one loop for each cycle of the paths, the output depends on them.
+    def get_loop_forest(self):
+        if self.loop_forest is None:
+            start = time.clock()
+            self.loop_forest = LoopForest(self.entry_point_addr, self.link_out)
+            elapsed = time.clock()
+            elapsed = elapsed - start
+            debug__("Loop forest: found %d loops in %fs" %
+                    (len(self.loop_forest), elapsed))
+        return self.loop_forest
 
 
     # Check d3/index.html !
@@ -204,100 +181,136 @@ class Graph:
         output.write("tryDraw();")
 
 
-    def __rec_explore(self, paths, p, new):
+    def __new_path(self, paths, p):
         myk = self.__key_path_count
         self.__key_path_count += 1
+
+        if self.__max_paths and myk >= self.__max_paths:
+            raise ExcLimit("paths", myk, len(self.loops))
+
+        # Don't call time.time() too often
+        if self.__deadline and myk & 0xff == 0 and \
+                time.time() > self.__deadline:
+            raise ExcLimit("time", myk, len(self.loops))
+
         paths.paths[myk] = p
-        p_set = set(p) # optimization search
+        return myk
 
-        while new in self.link_out:
-            if new in p_set:
-                # loop detected
-                idx_node = p.index(new)
-                l = p[idx_node:]
-                l_idx = index(self.loops, l)
 
-                if l_idx == -1:
-                    l_idx = len(self.loops)
-                    self.loops.append(l)
-                    self.loops_set.append(set(l))
+    def __add_loop(self, paths, p, new, myk):
+        idx_node = p.index(new)
+        sub = p[idx_node:]
+        l = list(sub)
+        l_idx = -1
+        same_start = self.loops_by_start.get(new, None)
 
-                paths.looping[myk] = l_idx
-                return
+        if same_start is None:
+            same_start = []
+            self.loops_by_start[new] = same_start
+        else:
+            for k in same_start:
+                if self.loops[k] == l:
+                    l_idx = k
+                    break
+
+        if l_idx == -1:
+            l_idx = len(self.loops)
+            self.loops.append(l)
+            self.loops_set.append(sub.bits)
+            same_start.append(l_idx)
+
+            if self.__max_loops and len(self.loops) > self.__max_loops:
+                raise ExcLimit("loops", myk + 1, len(self.loops))
+
+        paths.looping[myk] = l_idx
+
+
+    def __explore(self, entry):
+        paths = Paths()
+        start = time.clock()
+
+        # It's a DFS with an explicit stack (no recursion limit). Each
+        # element is (path, next address, key of the path), the key is -1
+        # for a new path. On a conditional jump, the current path is pushed
+        # before the new one, so it will be continued after : paths get
+        # the same keys as with a recursive exploration.
+        stack = [(Path(self), entry, -1)]
+
+        while stack:
+            p, new, myk = stack.pop()
+            if myk == -1:
+                myk = self.__new_path(paths, p)
+
+            while new in self.link_out:
+                if new in p:
+                    # loop detected
+                    self.__add_loop(paths, p, new, myk)
+                    break
 
-            else:
                 p.append(new)
-                p_set.add(new)
                 nxt = self.link_out[new]
 
                 # much faster than: is_cond_jump(self.dis.code[new])
                 if len(nxt) == 2:
-                    self.__rec_explore(paths, list(p), nxt[BRANCH_NEXT_JUMP])
+                    stack.append((p, nxt[BRANCH_NEXT], myk))
+                    stack.append((p.copy(), nxt[BRANCH_NEXT_JUMP], -1))
+                    break
 
                 new = nxt[BRANCH_NEXT]
+            else:
+                p.append(new)
 
-        p.append(new)
-
-
-    def __explore(self, entry):
-        paths = Paths()
-        start = time.clock()
-        self.__rec_explore(paths, [], entry)
         elapsed = time.clock()
         elapsed = elapsed - start
         debug__("Exploration: found %d paths and %d loop-paths in %fs" %
                 (len(paths.paths), len(paths.looping), elapsed))
+        self.nb_paths = len(paths.paths)
         return paths
 
 
     def __compute_nested(self):
         start = time.clock()
 
-        for k in range(len(self.loops)):
-            self.nested_loops_idx[k] = set()
-            self.direct_nested_idx[k] = set()
-
-        has_parent_loop_idx = set()
-
-        for k, l in enumerate(self.loops):
-            self.nested_loops_idx[k] = set()
-            self.direct_nested_idx[k] = set()
+        marked = self.marked
+        loops_set = self.loops_set
+        direct = [0] * len(self.loops)
+        has_parent_loop_idx = 0
 
         for k1, l1 in enumerate(self.loops):
-            if k1 in self.marked:
+            if (marked >> k1) & 1:
                 continue
             for addr in l1[1:]:
                 # check if addr is a beginning of another loop
-                # found = -1
-                for k2, l2 in enumerate(self.loops):
-                    if k2 in self.marked or \
-                            self.loops_set[k1] == self.loops_set[k2]:
+                for k2 in self.loops_by_start.get(addr, []):
+                    if (marked >> k2) & 1 or loops_set[k1] == loops_set[k2]:
                         continue
-                    if l2[0] == addr:
-                        self.direct_nested_idx[k1].add(k2) 
-                        self.nested_loops_idx[k1].add(k2) 
-                        has_parent_loop_idx.add(k2)
+                    direct[k1] |= 1 << k2
+                    has_parent_loop_idx |= 1 << k2
 
         # Warning : sometimes a sub-nested-loop didn't appear in a
         # parent-parent-loop. So we search for new nested.
         # See tests/nestedloop5 :
         # the path of the third loop is not in the first one
+        #
+        # nested_loops_idx is the transitive closure of direct_nested_idx,
+        # each loop is just a DFS on the direct nested loops.
 
-        while 1:
-            moved = False
-            for parent in self.nested_loops_idx:
-                l_par = self.nested_loops_idx[parent]
-                for nest in list(l_par):
-                    for subnest in self.nested_loops_idx[nest]:
-                        if subnest not in l_par:
-                            l_par.add(subnest)
-                            has_parent_loop_idx.add(subnest)
-                            moved = True
-            if not moved:
-                break
-
-        self.direct_nested_idx[-1] = set(range(len(self.loops))) - has_parent_loop_idx
-        self.nested_loops_idx[-1] = set(range(len(self.loops)))
+        for k in range(len(self.loops)):
+            nested = 0
+            stack = [direct[k]]
+            while stack:
+                new = stack.pop() & ~nested
+                nested |= new
+                while new:
+                    low = new & -new
+                    stack.append(direct[low.bit_length() - 1])
+                    new ^= low
+            self.direct_nested_idx[k] = direct[k]
+            self.nested_loops_idx[k] = nested
+
+        all_loops = (1 << len(self.loops)) - 1
+        self.direct_nested_idx[-1] = all_loops & ~has_parent_loop_idx
+        self.nested_loops_idx[-1] = all_loops
 
         elapsed = time.clock()
         elapsed = elapsed - start
@@ -335,42 +348,33 @@ class Graph:
 
         self.equiv = {}
 
-        for k1, l1 in enumerate(self.loops_set):
-            k2 = k1 + 1
-            while k2 < len(self.loops_set):
-                l2 = self.loops_set[k2]
-                if l1 == l2:
+        # Only loops with the same set of addresses are compared, so
+        # they are grouped by their bitmask.
+        groups = {}
+        for k, l in enumerate(self.loops_set):
+            if l in groups:
+                groups[l].append(k)
+            else:
+                groups[l] = [k]
+
+        for grp in groups.values():
+            for i, k1 in enumerate(grp):
+                for k2 in grp[i+1:]:
                     k = k1 if self.loops[k1][0] < self.loops[k2][0] else k2
-                    self.marked.add(k)
-                    self.__mark_addr(paths, k)
+                    self.marked |= 1 << k
                     self.equiv[k1] = k2
                     self.equiv[k2] = k1
-                k2 += 1
+
+        if self.marked:
+            self.__mark_addr(paths)
 
         # print(self.marked)
         # print_set(self.marked_addr)
 
 
-    def __mark_addr(self, paths, loop_idx):
-        for k in paths.looping:
-            if paths.looping[k] == loop_idx:
+    def __mark_addr(self, paths):
+        for k, loop_idx in paths.looping.items():
+            if (self.marked >> loop_idx) & 1:
                 idx_start_loop = paths.paths[k].index(self.loops[loop_idx][0])
                 before = paths.paths[k][idx_start_loop-1]
                 self.marked_addr.add(before)
-
-
-    def __get_loop_set(self, k):
-        s = self.loops_set[k]
-        for i in self.nested_loops_idx[k]:
-            s.update(self.loops_set[i])
-        return s
-
-
-    def __contains_nested(self, k):
-        return len(self.nested_loops_idx[k]) != 0
-
-
-    def __are_equiv(self, k1, k2):
-        s1 = self.__get_loop_set(k1)
-        s2 = self.__get_loop_set(k2)
-        return s1 == s2
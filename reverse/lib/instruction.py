@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+#
+# Reverse : Generate an indented asm code (pseudo-C) with colored syntax.
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Compact copies of the capstone instructions.
+#
+# A CsInsn keeps a copy of the capstone structures with all the details,
+# it's more than 1KB per instruction. Disassembler.code keeps all the
+# instructions of the session, so only the fields used in lib/arch are
+# copied in objects with __slots__. They have the same attributes as
+# CsInsn : i.operands[0].value.imm, i.operands[1].mem.disp, i.group(...)
+#
+# Most of the time is spent to build the operands in python, and a lot
+# of instructions are never printed (print_calls, lazy_disasm which
+# disassembles 1024 bytes, instructions in the graph which are not
+# jumps...). So an instruction is first built with only the id, the
+# groups and the size. The mnemonic, the operands and the details for
+# the architecture are loaded on the first read : the instruction is
+# disassembled again.
+
+import sys
+
+from capstone import CS_ARCH_ARM, CS_ARCH_X86, CS_OP_FP, CS_OP_MEM
+
+
+class Mem():
+    __slots__ = ("base", "index", "disp", "segment", "scale")
+
+    def __init__(self, base=0, index=0, disp=0, segment=0, scale=1):
+        self.base = base
+        self.index = index
+        self.disp = disp
+        self.segment = segment
+        self.scale = scale
+
+
+class Shift():
+    __slots__ = ("type", "value")
+
+    def __init__(self, typ, value):
+        self.type = typ
+        self.value = value
+
+
+NO_MEM = Mem()
+NO_SHIFT = Shift(0, 0)
+
+
+# The attributes which are not used for an architecture are only in
+# the class, there is a subclass for x86 and ARM.
+class Operand():
+    __slots__ = ("type", "imm", "reg", "mem")
+    size = 0
+    fp = 0.0
+    shift = NO_SHIFT
+
+    def __init__(self, op):
+        self.type = op.type
+        # In capstone it's an union, imm and reg are always read
+        self.imm = op.value.imm
+        self.reg = op.value.reg
+
+        if op.type == CS_OP_MEM:
+            mm = op.mem
+            self.mem = Mem(mm.base, getattr(mm, "index", 0), mm.disp,
+                           getattr(mm, "segment", 0), getattr(mm, "scale", 1))
+        else:
+            self.mem = NO_MEM
+
+
+    # op.value.imm, op.value.reg... as in capstone
+    @property
+    def value(self):
+        return self
+
+
+    def key(self):
+        m = self.mem
+        return (self.type, self.imm, self.reg, self.size, self.fp,
+                self.shift.type, self.shift.value,
+                m.base, m.index, m.disp, m.segment, m.scale)
+
+
+class OperandX86(Operand):
+    __slots__ = ("size", "fp")
+
+    def __init__(self, op):
+        Operand.__init__(self, op)
+        self.size = op.size
+        self.fp = op.value.fp if op.type == CS_OP_FP else 0.0
+
+
+class OperandARM(Operand):
+    __slots__ = ("fp", "shift")
+
+    def __init__(self, op):
+        Operand.__init__(self, op)
+        self.fp = op.value.fp if op.type == CS_OP_FP else 0.0
+        sh = op.shift
+        self.shift = NO_SHIFT if not sh.type else Shift(sh.type, sh.value)
+
+
+class Instruction():
+    __slots__ = ("address", "size", "id", "mnemonic", "op_str", "operands",
+                 "groups", "builder")
+    regs_read = ()
+
+    # Attributes set by set_detail
+    DETAIL = frozenset(("mnemonic", "op_str", "operands", "prefix", "cc",
+                        "update_flags", "regs_read"))
+
+    def __init__(self, builder, address, size, id, groups):
+        self.builder = builder
+        self.address = address
+        self.size = size
+        self.id = id
+        self.groups = groups
+
+
+    # Called only if the attribute is not set
+    def __getattr__(self, name):
+        if name not in self.DETAIL:
+            raise AttributeError(name)
+        self.builder.load_detail(self)
+        return object.__getattribute__(self, name)
+
+
+    def set_detail(self, builder, insn):
+        self.mnemonic = sys.intern(insn.mnemonic)
+        self.op_str = sys.intern(insn.op_str)
+        self.operands = builder.shared(
+                tuple(builder.operand(op) for op in insn.operands))
+
+
+    # The bytes are read again in the file
+    @property
+    def bytes(self):
+        return self.builder.read(self.address, self.size)
+
+
+    def group(self, grp):
+        return grp in self.groups
+
+
+    def reg_read(self, reg):
+        return reg in self.regs_read
+
+
+    def reg_name(self, reg):
+        return self.builder.reg_name(reg)
+
+
+class InstructionX86(Instruction):
+    __slots__ = ("prefix",)
+
+    def set_detail(self, builder, insn):
+        Instruction.set_detail(self, builder, insn)
+        self.prefix = builder.shared(tuple(insn.prefix))
+
+
+class InstructionARM(Instruction):
+    __slots__ = ("cc", "update_flags", "regs_read")
+
+    def set_detail(self, builder, insn):
+        Instruction.set_detail(self, builder, insn)
+        self.cc = insn.cc
+        self.update_flags = insn.update_flags
+        self.regs_read = builder.shared(tuple(insn.regs_read))
+
+
+# arch -> (instruction class, operand class)
+CLASSES = {
+    CS_ARCH_X86: (InstructionX86, OperandX86),
+    CS_ARCH_ARM: (InstructionARM, OperandARM),
+}
+
+
+# One builder per Disassembler. The names of the registers, the operands
+# and the tuples (groups, prefix...) are shared between all instructions :
+# they are never modified.
+class InstructionBuilder():
+    def __init__(self, md, binary):
+        self.__class, self.__operand_class = \
+            CLASSES.get(md.arch, (Instruction, Operand))
+        self.__md = md
+        self.__binary = binary
+        self.__shared = {}
+        self.__operands = {}
+        self.__reg_names = {}
+        # Only used to get the names of the registers, the registers
+        # come from the details so it's set in load_detail.
+        self.__insn = None
+
+
+    def shared(self, tup):
+        return self.__shared.setdefault(tup, tup)
+
+
+    def operand(self, op):
+        o = self.__operand_class(op)
+        return self.__operands.setdefault(o.key(), o)
+
+
+    def read(self, addr, size):
+        return bytes(self.__binary.section_stream_read(addr, size))
+
+
+    def reg_name(self, reg):
+        name = self.__reg_names.get(reg, None)
+        if name is None:
+            name = self.__insn.reg_name(reg)
+            self.__reg_names[reg] = name
+        return name
+
+
+    def __disasm_one(self, addr, size):
+        insn = next(self.__md.disasm(self.read(addr, size), addr, 1))
+        if self.__insn is None:
+            self.__insn = insn
+        return insn
+
+
+    def load_detail(self, inst):
+        inst.set_detail(self, self.__disasm_one(inst.address, inst.size))
+
+
+    def build(self, insn):
+        return self.__class(self, insn.address, insn.size, insn.id,
+                            self.shared(tuple(insn.groups)))
+
+
+    # Used by the linear sweep (lib/sweep.py) which doesn't keep the
+    # capstone instructions.
+    def build_from_row(self, address, size, id, groups):
+        return self.__class(self, address, size, id, self.shared(groups))
+
+
+    # Used when the instruction at addr is known but only the size was
+    # kept (sweep without the details). The instruction is disassembled
+    # with the details, so they are set now.
+    def build_at(self, addr, size):
+        insn = self.__disasm_one(addr, size)
+        inst = self.build(insn)
+        inst.set_detail(self, insn)
+        return inst
@@ -57,8 +57,10 @@ class Interactive():
             "lrawx86",
             "lrawx64",
             "sections",
+            "strings",
             "sym",
             "x",
+            "xrefs",
         ]
 
         self.COMMANDS = {
@@ -215,6 +217,27 @@ class Interactive():
                 "Print all sections",
                 ]
             ),
+
+            "strings": Command(
+                1,
+                self.__exec_strings,
+                None,
+                [
+                "[MIN_LEN]",
+                "Print all strings which are in the data sections.",
+                "Only strings with at least MIN_LEN chars are printed (default 4).",
+                ]
+            ),
+
+            "xrefs": Command(
+                1,
+                self.__exec_xrefs,
+                self.__complete_x,
+                [
+                "SYMBOL|0xXXXX|EP",
+                "Print all jumps and calls to this address.",
+                ]
+            ),
         }
 
         rl = ReadLine(self.exec_command, self.complete, self.send_control_c)
@@ -520,6 +543,20 @@ class Interactive():
             self.ctx.entry_addr = 0
 
 
+    def __exec_xrefs(self, args):
+        if len(args) != 2:
+            error("an address is required")
+            return
+        if self.ctx.dis is None:
+            error("load a file before")
+            return
+        self.ctx.entry = args[1]
+        if init_addr(self.ctx):
+            self.ctx.dis.print_xrefs(self.ctx, self.ctx.entry_addr)
+            self.ctx.entry = None
+            self.ctx.entry_addr = 0
+
+
     def __exec_help(self, args):
         for name in self.COMMANDS_ALPHA:
             cmd = self.COMMANDS[name]
@@ -543,3 +580,21 @@ class Interactive():
 
         for (name, start, end) in self.ctx.dis.binary.iter_sections():
             self.ctx.dis.print_section_meta(name, start, end) 
+
+
+    def __exec_strings(self, args):
+        if self.ctx.dis is None:
+            error("load a file before")
+            return
+        if len(args) == 1:
+            self.ctx.dis.print_strings()
+            return
+        try:
+            min_len = int(args[1])
+        except ValueError:
+            error("MIN_LEN must be a number")
+            return
+        if min_len <= 0:
+            error("MIN_LEN must be positive")
+            return
+        self.ctx.dis.print_strings(min_len)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+#
+# Reverse : Generate an indented asm code (pseudo-C) with colored syntax.
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Loop-nesting forest.
+#
+# The algorithm is the one from Havlak ("Nesting of reducible and
+# irreducible loops"), with the correction of Ramalingam. It works
+# directly on the graph (not on the paths) in almost linear time :
+# nodes are visited in reverse DFS preorder and each loop is collapsed
+# with an union-find when its header is reached.
+#
+# If a goto jumps inside a loop (tests/gotoinloop*), the loop is
+# irreducible : the header is the first block visited by the DFS and
+# the loop is flagged with irreducible = True.
+
+
+class Loop():
+    def __init__(self, header):
+        self.header = header
+        self.body = {header}
+        self.exits = set()
+        self.parent = None
+        self.children = []
+        self.depth = 1
+        self.irreducible = False
+
+
+class LoopForest():
+    def __init__(self, entry, link_out):
+        # header -> Loop
+        self.loops = {}
+
+        # Loops which are not nested
+        self.roots = []
+
+        # address -> innermost Loop
+        self.__innermost = {}
+
+        self.__build(entry, link_out)
+
+
+    def __dfs(self, entry, link_out):
+        # Iterative DFS, we don't want to depend on the recursion limit
+        number = {entry: 0}
+        order = [entry]
+        last = [0]
+        stack = [(entry, iter(link_out.get(entry, [])))]
+
+        while stack:
+            node, it = stack[-1]
+            for nxt in it:
+                if nxt not in number:
+                    number[nxt] = len(order)
+                    order.append(nxt)
+                    last.append(0)
+                    stack.append((nxt, iter(link_out.get(nxt, []))))
+                    break
+            else:
+                stack.pop()
+                last[number[node]] = len(order) - 1
+
+        return number, order, last
+
+
+    def __build(self, entry, link_out):
+        number, order, last = self.__dfs(entry, link_out)
+        n = len(order)
+
+        # All the work is done on the preorder numbers
+        back_preds = [[] for i in range(n)]
+        non_back_preds = [set() for i in range(n)]
+        for v in range(n):
+            for nxt in link_out.get(order[v], []):
+                w = number[nxt]
+                if w <= v <= last[w]:
+                    back_preds[w].append(v)
+                else:
+                    non_back_preds[w].add(v)
+
+        union = list(range(n))
+
+        def find(x):
+            root = x
+            while union[root] != root:
+                root = union[root]
+            while union[x] != root:
+                union[x], x = root, union[x]
+            return root
+
+        header = [-1] * n
+        is_header = [False] * n
+        irreducible = [False] * n
+
+        for w in range(n - 1, -1, -1):
+            body = []
+            body_set = set()
+            for v in back_preds[w]:
+                is_header[w] = True
+                if v != w:
+                    v = find(v)
+                    if v not in body_set:
+                        body.append(v)
+                        body_set.add(v)
+
+            worklist = list(body)
+            while worklist:
+                x = worklist.pop()
+                for y in non_back_preds[x]:
+                    y = find(y)
+                    if not (w <= y <= last[w]):
+                        # An entry which is not the header
+                        irreducible[w] = True
+                        non_back_preds[w].add(y)
+                    elif y not in body_set and y != w:
+                        body.append(y)
+                        body_set.add(y)
+                        worklist.append(y)
+
+            for x in body:
+                header[x] = w
+                union[x] = w
+
+        # Create the loops, the deepest are created first because their
+        # preorder number is greater than the one of their header.
+        for w in range(n - 1, -1, -1):
+            if not is_header[w]:
+                continue
+            l = Loop(order[w])
+            l.irreducible = irreducible[w]
+            self.loops[order[w]] = l
+
+        for w in range(n - 1, -1, -1):
+            ad = order[w]
+            h = header[w]
+
+            if is_header[w]:
+                l = self.loops[ad]
+                self.__innermost[ad] = l
+                if h != -1:
+                    parent = self.loops[order[h]]
+                    l.parent = parent
+                    parent.children.append(l)
+                    parent.body |= l.body
+                else:
+                    self.roots.append(l)
+            elif h != -1:
+                l = self.loops[order[h]]
+                l.body.add(ad)
+                self.__innermost[ad] = l
+
+        for l in self.loops.values():
+            for ad in l.body:
+                for nxt in link_out.get(ad, []):
+                    if nxt not in l.body:
+                        l.exits.add(nxt)
+
+        # Roots are first, then the depth is set from the parent
+        for w in range(n):
+            ad = order[w]
+            if is_header[w] and header[w] != -1:
+                l = self.loops[ad]
+                l.depth = l.parent.depth + 1
+
+
+    def __len__(self):
+        return len(self.loops)
+
+
+    def __contains__(self, ad):
+        return ad in self.__innermost
+
+
+    def is_header(self, ad):
+        return ad in self.loops
+
+
+    # Returns the innermost loop which contains ad, or None
+    def get_loop(self, ad):
+        return self.__innermost.get(ad, None)
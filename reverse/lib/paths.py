@@ -18,13 +18,168 @@
 #
 
 import sys
-import copy
+from array import array
 
 import lib.utils
 from lib.utils import (index, BRANCH_NEXT, BRANCH_NEXT_JUMP, print_list)
 from lib.ast import Ast_Goto
 
 
+# A path is stored as a list of segments (array, lo, hi) of block ids
+# (see Graph.addr_id) with a bitset (an int) of these ids. Arrays are
+# shared between paths : when a path is copied (at each conditional
+# jump during the exploration), only the list of segments is copied, so
+# the common prefix is stored once. An array is only extended by a path
+# which ends at the end of this array. The bitset is immutable, so it's
+# also shared.
+#
+# Cutting a path (pop, goto_addr, split) just moves the bounds of the
+# segments. There are no duplicated addresses in a path.
+#
+# The interface is the same as a list of addresses.
+class Path():
+    __slots__ = ("segs", "length", "bits", "addr_id", "id_addr")
+
+    def __init__(self, gph, addrs=None):
+        self.addr_id = gph.addr_id
+        self.id_addr = gph.id_addr
+        self.segs = []
+        self.length = 0
+        self.bits = 0
+        if addrs is not None:
+            for ad in addrs:
+                self.append(ad)
+
+
+    def __new_view(self, segs, length, bits):
+        p = Path.__new__(Path)
+        p.addr_id = self.addr_id
+        p.id_addr = self.id_addr
+        p.segs = segs
+        p.length = length
+        p.bits = bits
+        return p
+
+
+    def copy(self):
+        return self.__new_view(list(self.segs), self.length, self.bits)
+
+
+    def append(self, addr):
+        i = self.addr_id[addr]
+        if self.segs:
+            arr, lo, hi = self.segs[-1]
+            if hi == len(arr):
+                arr.append(i)
+                self.segs[-1] = (arr, lo, hi + 1)
+            else:
+                self.segs.append((array('I', [i]), 0, 1))
+        else:
+            self.segs.append((array('I', [i]), 0, 1))
+        self.length += 1
+        self.bits |= 1 << i
+
+
+    def iter_ids(self):
+        for arr, lo, hi in self.segs:
+            yield from arr[lo:hi]
+
+
+    # Returns the segments between the positions start and stop
+    def __sub_segs(self, start, stop):
+        segs = []
+        off = 0
+        for arr, lo, hi in self.segs:
+            n = hi - lo
+            if off + n > start and off < stop:
+                segs.append((arr, lo + max(start - off, 0),
+                             lo + min(stop - off, n)))
+            off += n
+            if off >= stop:
+                break
+        return segs
+
+
+    def __bits_of(self, segs):
+        bits = 0
+        for arr, lo, hi in segs:
+            for i in arr[lo:hi]:
+                bits |= 1 << i
+        return bits
+
+
+    def __contains__(self, addr):
+        i = self.addr_id.get(addr, -1)
+        return i != -1 and (self.bits >> i) & 1 == 1
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __iter__(self):
+        return map(self.id_addr.__getitem__, self.iter_ids())
+
+
+    def __eq__(self, other):
+        return isinstance(other, Path) and \
+               self.length == other.length and \
+               list(self.iter_ids()) == list(other.iter_ids())
+
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, _ = i.indices(self.length)
+            if stop <= start:
+                return self.__new_view([], 0, 0)
+            segs = self.__sub_segs(start, stop)
+            length = stop - start
+            # Compute the bitset with the smallest part
+            if length * 2 <= self.length:
+                bits = self.__bits_of(segs)
+            else:
+                bits = self.bits & \
+                       ~self.__bits_of(self.__sub_segs(0, start)) & \
+                       ~self.__bits_of(self.__sub_segs(stop, self.length))
+            return self.__new_view(segs, length, bits)
+
+        if i < 0:
+            i += self.length
+        if i < 0 or i >= self.length:
+            raise IndexError
+        for arr, lo, hi in self.segs:
+            if i < hi - lo:
+                return self.id_addr[arr[lo + i]]
+            i -= hi - lo
+
+
+    # Only the beginning of a path can be removed
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            n = min(i.stop, self.length)
+        else:
+            n = 1
+        self.bits &= ~self.__bits_of(self.__sub_segs(0, n))
+        self.segs = self.__sub_segs(n, self.length)
+        self.length -= n
+
+
+    def index(self, addr, k=0):
+        i = self.addr_id.get(addr, -1)
+        if i == -1 or (self.bits >> i) & 1 == 0:
+            raise ValueError
+        off = 0
+        for arr, lo, hi in self.segs:
+            try:
+                idx = off + arr[lo:hi].index(i)
+                break
+            except ValueError:
+                off += hi - lo
+        if idx < k:
+            raise ValueError
+        return idx
+
+
 class Paths():
     def __init__(self, gph=None):
         self.looping = {}  # key_path -> idx_loop
@@ -38,6 +193,9 @@ class Paths():
     def cache_obj(self):
         # For avoiding sub-access
         self.gph_loops            = self.gph.loops
+        self.gph_loops_set        = self.gph.loops_set
+        self.gph_addr_id          = self.gph.addr_id
+        self.gph_loops_by_start   = self.gph.loops_by_start
         self.gph_marked_addr      = self.gph.marked_addr
         self.gph_cond_jumps_set   = self.gph.cond_jumps_set
         self.gph_uncond_jumps_set = self.gph.uncond_jumps_set
@@ -46,13 +204,24 @@ class Paths():
 
     def copy(self):
         newp = Paths(self.gph)
-        newp.looping = copy.deepcopy(self.looping)
-        newp.paths = copy.deepcopy(self.paths)
+        newp.looping = dict(self.looping)
+        newp.paths = {k: p.copy() for k, p in self.paths.items()}
         return newp
 
 
     def __contains__(self, addr):
-        return any(addr in p for p in self.paths.values())
+        i = self.gph.addr_id.get(addr, -1)
+        if i == -1:
+            return False
+        return any((p.bits >> i) & 1 for p in self.paths.values())
+
+
+    # Use it instead of __contains__ when there are many addresses to check
+    def addr_set(self):
+        bits = 0
+        for p in self.paths.values():
+            bits |= p.bits
+        return {ad for i, ad in enumerate(self.gph.id_addr) if (bits >> i) & 1}
 
 
     def __is_in_curr_loop(self, loop):
@@ -88,8 +257,9 @@ class Paths():
 
 
     def get_loops_idx(self):
-        return {k for k, l in enumerate(self.gph_loops) \
-                      if self.__is_in_curr_loop(l)}
+        # Only loops which start at the first address can be the current
+        return {k for k in self.gph_loops_by_start.get(self.first(), []) \
+                      if self.__is_in_curr_loop(self.gph_loops[k])}
 
 
     def debug(self):
@@ -126,8 +296,7 @@ class Paths():
     # we go on the loop which starts in the middle, we returns
     # force_stop = True.
     #
-    def __enter_new_loop(self, curr_loop_idx, key_path, i):
-        addr = self.paths[key_path][i]
+    def __enter_new_loop(self, curr_loop_idx, key_path, addr):
         is_loop = key_path in self.looping
 
         # TODO not sure
@@ -191,7 +360,7 @@ class Paths():
             for p in it:
                 del p[0]
         else:
-            poped = p[:n]
+            poped = list(p[:n])
             del p[:n]
             for p in it:
                 del p[:n]
@@ -238,31 +407,36 @@ class Paths():
         # if we have a too smal path, we can stop too early.
         # tests/nestedloop3
         refpath = self.__longuest_path()
+        id_addr = self.gph.id_addr
+
+        # All paths are walked at the same time, we just need to
+        # check that an address is in a path with the bitsets.
+        others = [(k, p.iter_ids(), p.bits) for k, p in self.paths.items()
+                  if k != refpath]
 
         nb_commons = 0
-        for i in range(len(self.paths[refpath])):
-            addr0 = self.paths[refpath][i]
+        for i, id0 in enumerate(self.paths[refpath].iter_ids()):
+            addr0 = id_addr[id0]
 
             # Searching if it's a loop or a ifelse must be in differents loops
             # because for a conditional jump can a loop or a ifelse. Priority
             # is for loops.
 
             # Check if addr0 is the beginning of a loop
-            is_loop, force_stop = self.__enter_new_loop(curr_loop_idx, refpath, i)
+            is_loop, force_stop = self.__enter_new_loop(curr_loop_idx, refpath, addr0)
             if is_loop or force_stop:
                 return nb_commons, is_loop, False, (force_stop and addr0)
 
             # Compare with other paths
-            for k, p in self.paths.items():
-                if k == refpath:
-                    continue
-
-                if addr0 not in p:
+            others_addr = []
+            for k, it, bits in others:
+                if not (bits >> id0) & 1:
                     return nb_commons, False, False, 0
 
-                addr = p[i]
+                addr = id_addr[next(it)]
+                others_addr.append(addr)
 
-                is_loop, force_stop = self.__enter_new_loop(curr_loop_idx, k, i)
+                is_loop, force_stop = self.__enter_new_loop(curr_loop_idx, k, addr)
                 if is_loop or force_stop:
                     return nb_commons, is_loop, False, (force_stop and addr)
 
@@ -275,15 +449,7 @@ class Paths():
                     return nb_commons, False, True, 0
 
             # Compare with other paths
-            for k, p in self.paths.items():
-                if k == refpath:
-                    continue
-
-                if addr0 not in p:
-                    return nb_commons, False, False, 0
-
-                addr = p[i]
-
+            for addr in others_addr:
                 if addr in self.gph_cond_jumps_set:
                     nxt = self.gph_link_out[addr]
                     c1 = self.loop_contains(curr_loop_idx, nxt[BRANCH_NEXT])
@@ -330,6 +496,20 @@ class Paths():
         return self.first_common(curr_loop_idx)
 
 
+    # Returns the first non-looping path and the intersection of the
+    # bitsets of all non-looping paths. The path is None if all paths
+    # are looping.
+    def __non_looping_common(self, curr_loop_idx):
+        ref = None
+        common = -1
+        for k, p in self.paths.items():
+            if not self.__is_looping(k, curr_loop_idx):
+                if ref is None:
+                    ref = p
+                common &= p.bits
+        return ref, common
+
+
     def first_common(self, curr_loop_idx):
         # Take a non looping-path as a reference :
         # we want to search a common address between other paths
@@ -342,20 +522,18 @@ class Paths():
         if refpath == -1:
             return -1
 
-        # Compare refpath with other paths
+        # Compare refpath with other paths : the intersection of all
+        # bitsets gives the common addresses.
 
-        for val in self.paths[refpath]:
-            found = True
-            is_enter = False
-            for k in self.paths:
-                if k != refpath and not self.__is_looping(k, curr_loop_idx):
-                    is_enter = True
-                    if val not in self.paths[k]:
-                        found = False
-                        break
+        common = -1
+        for k, p in self.paths.items():
+            if k != refpath and not self.__is_looping(k, curr_loop_idx):
+                common &= p.bits
 
-            if found and is_enter:
-                return val
+        if common != -1:
+            for i in self.paths[refpath].iter_ids():
+                if (common >> i) & 1:
+                    return self.gph.id_addr[i]
 
         return self.next_addr
 
@@ -420,7 +598,8 @@ class Paths():
     def loop_contains(self, loop_start_idx, addr):
         if not loop_start_idx:
             return True
-        return any(addr in self.gph_loops[i] for i in loop_start_idx)
+        i = self.gph_addr_id[addr]
+        return any((self.gph_loops_set[l] >> i) & 1 for l in loop_start_idx)
                     
 
     # For a loop : check if the path need to be kept (the loop 
@@ -441,10 +620,10 @@ class Paths():
             return True, False
 
         for i in curr_loop_idx:
-            if l_idx in self.gph.nested_loops_idx[i]:
+            if (self.gph.nested_loops_idx[i] >> l_idx) & 1:
                 return True, False
 
-        if l_idx in self.gph.marked:
+        if (self.gph.marked >> l_idx) & 1:
             return False, True
 
         return False, False
@@ -474,14 +653,15 @@ class Paths():
                     tmp_loopends.add_path(k, p, self.__get_loop_idx(k))
 
         # Remove the beginning of the loop to get only the loopend
+        loop_addr = loop_paths.addr_set()
         for k, el in tmp_loopends.paths.items():
             for i, addr in enumerate(el):
-                if addr not in loop_paths:
+                if addr not in loop_addr:
                     p = el[i:]
                     if not p in tmp_loopends.paths.values():
                         tmp_loopends.paths[k] = p
                     else:
-                        tmp_loopends.paths[k] = []
+                        tmp_loopends.paths[k] = Path(self.gph)
                     break
 
         tmp_loopends.rm_empty_paths()
@@ -522,18 +702,23 @@ class Paths():
         # between two paths. A path will be cut at this endpoint.
         # ------------------------------------------------------
 
-        def search_first_common(loops_idx, p1, p2):
+        # It's the same as first_common on the union of two groups, but the
+        # intersection of each group is computed only once.
+        grp_common = {ad: els.__non_looping_common(last_loop_idx)
+                      for ad, els in grp_loopends.items()}
+        id_addr = self.gph.id_addr
+
+        def search_first_common(ad1, ad2):
+            ref, bits1 = grp_common[ad1]
+            ref2, bits2 = grp_common[ad2]
             # TODO hack...
-            if p1.are_all_looping(-1, False, loops_idx) or \
-                p2.are_all_looping(-1, False, loops_idx):
+            if ref is None or ref2 is None:
                 return -1
-            # TODO optimize
-            tmp = Paths(self.gph)
-            tmp.paths.update(p1.paths)
-            tmp.paths.update(p2.paths)
-            tmp.looping.update(p1.looping)
-            tmp.looping.update(p2.looping)
-            return tmp.first_common(loops_idx)
+            common = bits1 & bits2
+            for i in ref.iter_ids():
+                if (common >> i) & 1:
+                    return id_addr[i]
+            return -1
 
         # Check if the address n is the next address of g
         def has_next(g, n):
@@ -555,7 +740,7 @@ class Paths():
             for ad2 in grp2_keys:
                 els2 = grp_loopends[ad2]
 
-                endpoint = search_first_common(last_loop_idx, els1, els2)
+                endpoint = search_first_common(ad1, ad2)
                 # print("endpoint: ", hex(ad1), hex(ad2), "=", hex(endpoint))
 
                 if endpoint != -1:
@@ -578,7 +763,7 @@ class Paths():
                     all_endpoints[endif].add(ad)
 
             grp_loopends[endif] = Paths(self.gph)
-            grp_loopends[endif].paths[-1] = [endif]
+            grp_loopends[endif].paths[-1] = Path(self.gph, [endif])
 
 
         # ------------------------------------------------------
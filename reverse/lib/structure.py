@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+#
+# Reverse : Generate an indented asm code (pseudo-C) with colored syntax.
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Structuring based on the post-dominators (option --dominators).
+#
+# Unlike generate_ast, it doesn't enumerate paths : each block is
+# visited once. The join point of an if/else is the immediate
+# post-dominator of the conditional jump, loops come from the
+# loop-nesting forest (lib/loops.py). When a block has already been
+# printed, a goto is added instead.
+
+import time
+
+from lib.ast import (Ast_Branch, Ast_Comment, Ast_Goto, Ast_Loop,
+        Ast_IfGoto, Ast_Ifelse, Ast_AndIf)
+from lib.dominator import compute_ipdom, VIRTUAL_EXIT
+from lib.exceptions import ExcLimit
+from lib.generate_ast import process_ast
+from lib.utils import BRANCH_NEXT, BRANCH_NEXT_JUMP, debug__, trampoline
+
+
+class Structure():
+    def __init__(self, ctx, gph):
+        self.ctx = ctx
+        self.gph = gph
+
+        # header -> Loop
+        self.loops = gph.get_loop_forest().loops
+
+        # loop header (or -1 for the whole function) -> ipdom dict
+        self.__ipdom = {}
+
+
+    def __get_ipdom_dict(self, loop):
+        key = -1 if loop is None else loop.header
+
+        if key not in self.__ipdom:
+            if loop is None:
+                self.__ipdom[key] = self.gph.get_ipdom()
+            else:
+                # Inside a loop, the back-edges are considered as exits :
+                # we want the join point before the next iteration. The
+                # loopends are not in the body, so they are ignored.
+                self.__ipdom[key] = compute_ipdom(loop.body, self.gph.link_out,
+                                                  {loop.header})
+
+        return self.__ipdom[key]
+
+
+    # Returns False if all paths from ad are infinite loops
+    def __can_exit(self, loop, ad):
+        if loop is not None and ad == loop.header:
+            return True
+        return ad in self.__get_ipdom_dict(loop)
+
+
+    def __get_ipdom(self, loop, ad):
+        ad = self.__get_ipdom_dict(loop).get(ad, VIRTUAL_EXIT)
+
+        # The end of the loop body
+        if ad == VIRTUAL_EXIT and loop is not None:
+            return loop.header
+        return ad
+
+
+    def __get_prefetch(self, blk):
+        # A jump is normally alone in a block, but for some architectures
+        # we save the prefetched instruction after.
+        if len(blk) == 2:
+            return blk[1]
+        return None
+
+
+    def __get_ast_ifgoto(self, ad, loop):
+        ARCH_UTILS = self.ctx.libarch.utils
+        blk = self.gph.nodes[ad]
+        inst = blk[0]
+        nxt = self.gph.link_out[ad]
+
+        # Same as generate_ast.get_ast_ifgoto : we goto the block which
+        # is outside the loop.
+        if nxt[BRANCH_NEXT_JUMP] in loop.body:
+            cond_id = ARCH_UTILS.invert_cond(inst)
+            br = nxt[BRANCH_NEXT]
+            inside = nxt[BRANCH_NEXT_JUMP]
+        else:
+            cond_id = ARCH_UTILS.get_cond(inst)
+            br = nxt[BRANCH_NEXT_JUMP]
+            inside = nxt[BRANCH_NEXT]
+
+        return Ast_IfGoto(inst, cond_id, br, self.__get_prefetch(blk)), inside
+
+
+    def __get_ast_ifelse(self, ad, stops, loop):
+        blk = self.gph.nodes[ad]
+        nxt = self.gph.link_out[ad]
+        endpoint = self.__get_ipdom(loop, ad)
+
+        #
+        # if () {
+        #   ...
+        # } else {
+        #   infiniteloop ...
+        # }
+        #
+        # can be simplified by : (the endpoint is the else-part)
+        #
+        # if () {
+        #   ...
+        # }
+        # infiniteloop ...
+        #
+        if endpoint == -1 or (loop is not None and endpoint == loop.header):
+            c1 = self.__can_exit(loop, nxt[BRANCH_NEXT])
+            c2 = self.__can_exit(loop, nxt[BRANCH_NEXT_JUMP])
+            if c1 and not c2:
+                endpoint = nxt[BRANCH_NEXT_JUMP]
+            elif c2 and not c1:
+                endpoint = nxt[BRANCH_NEXT]
+
+        if endpoint != -1:
+            stops = stops | {endpoint}
+
+        # The if-part is built with last_else for the "and if" (see the
+        # comments in generate_ast.get_ast_ifelse).
+        a1 = yield self.get_ast_branch(nxt[BRANCH_NEXT], endpoint, stops,
+                                       loop, nxt[BRANCH_NEXT_JUMP])
+        a2 = yield self.get_ast_branch(nxt[BRANCH_NEXT_JUMP], endpoint, stops,
+                                       loop)
+
+        return Ast_Ifelse(blk[0], a2, a1, self.__get_prefetch(blk)), endpoint
+
+
+    def __get_ast_andif(self, ad, last_else):
+        ARCH_UTILS = self.ctx.libarch.utils
+        blk = self.gph.nodes[ad]
+        inst = blk[0]
+        nxt = self.gph.link_out[ad]
+
+        if nxt[BRANCH_NEXT_JUMP] == last_else:
+            return (Ast_AndIf(inst, ARCH_UTILS.invert_cond(inst),
+                              self.__get_prefetch(blk)),
+                    nxt[BRANCH_NEXT])
+
+        if nxt[BRANCH_NEXT] == last_else:
+            return (Ast_AndIf(inst, ARCH_UTILS.get_cond(inst),
+                              self.__get_prefetch(blk)),
+                    nxt[BRANCH_NEXT_JUMP])
+
+        return None, -1
+
+
+    def __get_ast_loop(self, loop, stops):
+        ast = Ast_Loop()
+        ast.set_infinite(not loop.exits)
+
+        h = loop.header
+        branch = Ast_Branch()
+        nxt = yield self.__add_node(branch, h, stops | {h}, loop)
+        yield self.__walk(branch, nxt, h, stops | {h}, loop)
+        ast.set_branch(branch)
+
+        # The follow of the loop is the first address after the loop
+        # which post-dominates the header in the parent loop. Exits which
+        # are outside the parent loop are only gotos here, they will be
+        # printed in the epilog of the parent.
+        parent = loop.parent
+        follow = self.__get_ipdom(parent, h)
+        while follow in loop.body:
+            follow = self.__get_ipdom(parent, follow)
+
+        loopends = [ad for ad in sorted(loop.exits)
+                    if ad not in stops and
+                       (parent is None or ad in parent.body)]
+
+        # With only one loopend, we continue directly on it.
+        if len(loopends) == 1 or (follow == -1 and loopends):
+            follow = loopends[-1]
+
+        others = [ad for ad in loopends if ad != follow]
+        if not others:
+            return ast, follow
+
+        epilog = Ast_Branch()
+        epilog_num = 1
+
+        if follow != -1:
+            stops = stops | {follow}
+
+        for ad in others:
+            epilog.add(Ast_Comment("loopend " + str(epilog_num)))
+            epilog_num += 1
+            epilog.add((yield self.get_ast_branch(ad, follow, stops, parent)))
+
+        if follow in loopends:
+            epilog.add(Ast_Comment("loopend " + str(epilog_num)))
+
+        ast.set_epilog(epilog)
+        return ast, follow
+
+
+    # Add the block at the address ad in the ast and returns the next
+    # address to visit (-1 if there is nothing after).
+    def __add_node(self, ast, ad, stops, loop, last_else=-1):
+        self.ctx.seen.add(ad)
+        blk = self.gph.nodes[ad]
+        nxt = self.gph.link_out.get(ad, None)
+
+        if nxt is None:
+            ast.add(blk)
+            return -1
+
+        if len(nxt) == 1:
+            ast.add(blk)
+            return nxt[BRANCH_NEXT]
+
+        # Conditional jump, it's a loop exit, an "and if" or an if/else
+        if loop is not None and (nxt[BRANCH_NEXT] not in loop.body or
+                nxt[BRANCH_NEXT_JUMP] not in loop.body):
+            a, ad = self.__get_ast_ifgoto(ad, loop)
+        else:
+            a = None
+            if last_else != -1:
+                a, nxt_ad = self.__get_ast_andif(ad, last_else)
+            if a is None:
+                a, nxt_ad = yield self.__get_ast_ifelse(ad, stops, loop)
+            ad = nxt_ad
+
+        ast.add(a)
+        return ad
+
+
+    def __walk(self, ast, ad, stop, stops, loop, last_else=-1):
+        is_if_printed = False
+
+        while ad != -1:
+            if self.ctx.deadline and time.time() > self.ctx.deadline:
+                raise ExcLimit("time", 0, len(self.loops), len(self.ctx.seen))
+
+            if ad == stop:
+                break
+
+            if ad in stops or ad in self.ctx.seen:
+                ast.add(Ast_Goto(ad))
+                break
+
+            if ad in self.loops and self.loops[ad] is not loop:
+                a, ad = yield self.__get_ast_loop(self.loops[ad], stops)
+                ast.add(a)
+                continue
+
+            if self.ctx.print_andif and not is_if_printed:
+                ad = yield self.__add_node(ast, ad, stops, loop, last_else)
+            else:
+                ad = yield self.__add_node(ast, ad, stops, loop)
+
+            # is_if_printed : better output (tests/if5)
+            last = ast.nodes[-1] if ast.nodes else None
+            if isinstance(last, (Ast_Ifelse, Ast_AndIf)):
+                is_if_printed = isinstance(last, Ast_Ifelse)
+
+
+    # Returns the ast from the address ad until stop (excluded). stops
+    # contains all addresses where a parent will continue, if one of these
+    # addresses is reached a goto is added.
+    #
+    # All functions which build the ast are generators, they are run with
+    # lib.utils.trampoline (see generate_ast).
+    def get_ast_branch(self, ad, stop=-1, stops=frozenset(), loop=None,
+                       last_else=-1):
+        ast = Ast_Branch()
+        yield self.__walk(ast, ad, stop, stops, loop, last_else)
+        return ast
+
+
+def generate_ast_dom(ctx, gph):
+    start = time.clock()
+
+    st = Structure(ctx, gph)
+    ast = trampoline(st.get_ast_branch(gph.entry_point_addr))
+
+    elapsed = time.clock()
+    elapsed = elapsed - start
+    debug__("Ast generated with dominators (%d blocks, %d loops) in %fs" %
+            (len(gph.nodes), len(st.loops), elapsed))
+
+    return process_ast(ctx, ast)
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+#
+# Reverse : Generate an indented asm code (pseudo-C) with colored syntax.
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+# Linear sweep of an executable section.
+#
+# The whole section is disassembled once from the start, as print_calls
+# did with lazy_disasm : when capstone can't disassemble at an address
+# the byte is skipped. Only a few columns are kept for each instruction,
+# in parallel arrays (~14 bytes per instruction).
+#
+# The sweep is first done without the details to get the addresses and
+# the sizes. The other columns (id, groups, flags) are loaded when they
+# are needed by disassembling again the section with the details. The
+# instructions are rebuilt from a row with build_from_row.
+#
+# The flags are computed with the functions of lib/arch/*/utils. On x86
+# they only depend on the id and the groups, so they are computed once
+# for each couple (id, groups). The target is the immediate of the last
+# operand of a jump or a call, the targets are only loaded for the
+# first xrefs query : reading the operands in python is slow.
+#
+# With --jobs N, big sections are split in N chunks disassembled by
+# worker processes. A chunk may start in the middle of an instruction :
+# when the chunks are merged, the instructions are disassembled again
+# from the end of the previous chunk until we reach an address found by
+# the worker (on x86 the two streams converge after a few instructions).
+# The details are loaded in the same way, but the chunks start on the
+# instructions found by the sweep.
+
+import time
+import ctypes
+import importlib
+from array import array
+from bisect import bisect_right, bisect_left
+from concurrent.futures import ProcessPoolExecutor
+
+from capstone import Cs, CS_OP_IMM
+
+from lib.utils import debug__
+
+
+FLAG_JUMP = 1
+FLAG_CALL = 2
+FLAG_TARGET = 4
+
+# The section is disassembled by chunks : capstone allocates all the
+# instructions of a buffer with their details.
+CHUNK = 0x10000
+
+# Maximum size of an instruction (x86)
+MAX_INST = 16
+
+# Smaller sections are not split between processes
+PARALLEL_MIN_SIZE = 0x100000
+
+
+# Given to is_jump and is_call instead of the capstone instruction to
+# know if they have read something else than the id and the groups.
+class FlagsProbe():
+    __slots__ = ("insn", "id", "groups", "read_detail")
+
+    def __init__(self, insn, groups):
+        self.insn = insn
+        self.id = insn.id
+        self.groups = groups
+        self.read_detail = False
+
+
+    def group(self, grp):
+        return grp in self.groups
+
+
+    def __getattr__(self, name):
+        self.read_detail = True
+        return getattr(self.insn, name)
+
+
+# Columns loaded with the details
+class DetailColumns():
+    def __init__(self, arch_utils):
+        self.id = array("H")
+        self.groups = array("H")
+        self.flags = array("B")
+        # index in self.groups -> tuple of groups
+        self.groups_table = []
+
+        self.__arch_utils = arch_utils
+        self.__groups_idx = {}
+        # (id, groups index) -> flags
+        self.__flags_cache = {}
+
+
+    def __getstate__(self):
+        return (self.id, self.groups, self.flags, self.groups_table)
+
+
+    def __setstate__(self, state):
+        self.id, self.groups, self.flags, self.groups_table = state
+
+
+    def __get_groups_idx(self, grp):
+        g = self.__groups_idx.get(grp, None)
+        if g is None:
+            g = len(self.groups_table)
+            self.__groups_idx[grp] = g
+            self.groups_table.append(grp)
+        return g
+
+
+    def __get_flags(self, insn, grp):
+        arch_utils = self.__arch_utils
+        p = FlagsProbe(insn, grp)
+        if arch_utils.is_call(p):
+            flags = FLAG_CALL
+        else:
+            try:
+                flags = FLAG_JUMP if arch_utils.is_jump(p) else 0
+            except IndexError:
+                # arm : instruction without operands
+                flags = 0
+        return flags, p.read_detail
+
+
+    def add(self, insn):
+        grp = tuple(insn.groups)
+        g = self.__get_groups_idx(grp)
+
+        key = (insn.id, g)
+        fl = self.__flags_cache.get(key, None)
+        if fl is None:
+            fl, read_detail = self.__get_flags(insn, grp)
+            if not read_detail:
+                self.__flags_cache[key] = fl
+
+        self.id.append(insn.id)
+        self.groups.append(g)
+        self.flags.append(fl)
+
+
+    # Adds the columns of a chunk returned by a worker
+    def extend(self, cols):
+        remap = [self.__get_groups_idx(grp) for grp in cols.groups_table]
+        self.id.extend(cols.id)
+        self.groups.extend(array("H", [remap[g] for g in cols.groups]))
+        self.flags.extend(cols.flags)
+
+
+# Disassembles from ad and adds the instructions which are before stop.
+# The bytes are read with read(addr, size) until last (included), the
+# instructions are given to add(insn). Returns the address where the
+# sweep continues (>= stop).
+def sweep_range(md, read, ad, last, stop, add, lite):
+    while ad < stop:
+        d = read(ad, min(CHUNK, last + 1 - ad))
+        if not d:
+            break
+
+        # d is a view, capstone reads it directly
+        d = (ctypes.c_char * len(d)).from_buffer(d)
+        nxt = ad
+
+        if lite:
+            for i in md.disasm_lite(d, ad):
+                if i[0] >= stop:
+                    break
+                add(i)
+                nxt = i[0] + i[1]
+        else:
+            for i in md.disasm(d, ad):
+                if i.address >= stop:
+                    break
+                add(i)
+                nxt = i.address + i.size
+
+        # Nothing was disassembled, skip the bad byte. Otherwise
+        # capstone has stopped on a bad instruction or at the end of
+        # the chunk, we continue from there.
+        ad = nxt + 1 if nxt == ad else nxt
+
+    return ad
+
+
+# Functions executed by the workers, data contains the bytes from start
+# to stop + MAX_INST.
+
+def sweep_chunk(arch, mode, data, start, stop):
+    addr = array("Q")
+    size = array("B")
+
+    def add(i):
+        addr.append(i[0])
+        size.append(i[1])
+
+    view = memoryview(data)
+    read = lambda ad, n: view[ad - start:ad - start + n]
+    nxt = sweep_range(Cs(arch, mode), read, start, start + len(data) - 1,
+                      stop, add, True)
+    return addr, size, nxt
+
+
+def load_detail_chunk(arch, mode, utils_name, data, start, stop):
+    md = Cs(arch, mode)
+    md.detail = True
+    cols = DetailColumns(importlib.import_module(utils_name))
+    view = memoryview(data)
+    read = lambda ad, n: view[ad - start:ad - start + n]
+    sweep_range(md, read, start, start + len(data) - 1, stop, cols.add, False)
+    return cols
+
+
+class SectionSweep():
+    def __init__(self, md, binary, arch_utils, name, start, end, jobs=1):
+        self.name = name
+        self.start = start
+        # Last address of the section (as in get_section_meta)
+        self.end = end
+
+        self.addr = array("Q")
+        self.size = array("B")
+
+        # Set by __load_detail
+        self.id = None
+        self.groups = None
+        self.flags = None
+        self.groups_table = None
+
+        # Set by __load_targets
+        self.target = None
+
+        self.__md = md
+        self.__binary = binary
+        self.__arch_utils = arch_utils
+        self.__jobs = jobs
+        if self.end + 1 - self.start < PARALLEL_MIN_SIZE:
+            self.__jobs = 1
+
+        self.__sweep()
+
+
+    def __read(self, ad, size):
+        return self.__binary.section_stream_read(ad, size)
+
+
+    # Bytes given to a worker
+    def __get_chunk_data(self, start, stop):
+        return bytearray(self.__read(start, min(stop + MAX_INST,
+                                                self.end + 1) - start))
+
+
+    def __add_lite(self, i):
+        self.addr.append(i[0])
+        self.size.append(i[1])
+
+
+    def __sweep(self):
+        start_time = time.clock()
+
+        md = Cs(self.__md.arch, self.__md.mode)
+
+        if self.__jobs == 1:
+            sweep_range(md, self.__read, self.start, self.end, self.end + 1,
+                        self.__add_lite, True)
+        else:
+            self.__sweep_parallel(md)
+
+        elapsed = time.clock()
+        elapsed = elapsed - start_time
+        debug__("Section %s swept in %fs (%d instructions, %d jobs)" %
+                (self.name, elapsed, len(self.addr), self.__jobs))
+
+
+    def __sweep_parallel(self, md):
+        jobs = self.__jobs
+        size = self.end + 1 - self.start
+
+        # Aligned on MAX_INST for the architectures with fixed size
+        # instructions.
+        bounds = [self.start + (size * k // jobs) // MAX_INST * MAX_INST
+                  for k in range(jobs)]
+        bounds.append(self.end + 1)
+
+        with ProcessPoolExecutor(jobs) as executor:
+            futures = [executor.submit(sweep_chunk, md.arch, md.mode,
+                                       self.__get_chunk_data(b0, b1), b0, b1)
+                       for b0, b1 in zip(bounds, bounds[1:])]
+
+            ad = self.start
+            for fut, b1 in zip(futures, bounds[1:]):
+                addr, size, nxt = fut.result()
+
+                # Disassemble one instruction at a time until we are
+                # synchronized with the worker.
+                n = bisect_left(addr, ad)
+                while ad < b1 and (n == len(addr) or addr[n] != ad):
+                    ad = sweep_range(md, self.__read, ad,
+                                     min(ad + MAX_INST - 1, self.end), ad + 1,
+                                     self.__add_lite, True)
+                    n = bisect_left(addr, ad, n)
+
+                if ad < b1:
+                    self.addr.extend(addr[n:])
+                    self.size.extend(size[n:])
+                    ad = nxt
+
+
+    def __load_detail(self):
+        start_time = time.clock()
+        cols = DetailColumns(self.__arch_utils)
+
+        if self.__jobs == 1:
+            sweep_range(self.__md, self.__read, self.start, self.end,
+                        self.end + 1, cols.add, False)
+        else:
+            self.__load_detail_parallel(cols)
+
+        self.id = cols.id
+        self.groups = cols.groups
+        self.flags = cols.flags
+        self.groups_table = cols.groups_table
+
+        elapsed = time.clock()
+        elapsed = elapsed - start_time
+        debug__("Details of the section %s loaded in %fs" %
+                (self.name, elapsed))
+
+
+    def __load_detail_parallel(self, cols):
+        md = self.__md
+        jobs = self.__jobs
+        nb = len(self.addr)
+
+        # The chunks start on the instructions of the sweep
+        rows = [nb * k // jobs for k in range(jobs + 1)]
+        bounds = [self.addr[n] for n in rows[:-1]] + [self.end + 1]
+
+        with ProcessPoolExecutor(jobs) as executor:
+            futures = [executor.submit(load_detail_chunk, md.arch, md.mode,
+                                       self.__arch_utils.__name__,
+                                       self.__get_chunk_data(b0, b1), b0, b1)
+                       for b0, b1 in zip(bounds, bounds[1:])
+                       if b0 < b1]
+            for fut in futures:
+                cols.extend(fut.result())
+
+
+    def __load_targets(self):
+        self.target = array("q", [0]) * len(self.addr)
+        for n in self.iter_flag(FLAG_JUMP | FLAG_CALL):
+            ad = self.addr[n]
+            code = bytes(self.__binary.section_stream_read(ad, self.size[n]))
+            ops = next(self.__md.disasm(code, ad, 1)).operands
+            if ops and ops[-1].type == CS_OP_IMM:
+                self.flags[n] |= FLAG_TARGET
+                self.target[n] = ops[-1].value.imm
+
+
+    def __len__(self):
+        return len(self.addr)
+
+
+    # Returns the row of the instruction at addr, or -1 if the sweep
+    # has not disassembled this address.
+    def find(self, addr):
+        n = bisect_left(self.addr, addr)
+        if n < len(self.addr) and self.addr[n] == addr:
+            return n
+        return -1
+
+
+    def has_detail(self):
+        return self.id is not None
+
+
+    def get_row(self, n):
+        if self.id is None:
+            self.__load_detail()
+        return (self.addr[n], self.size[n], self.id[n],
+                self.groups_table[self.groups[n]])
+
+
+    def iter_flag(self, flag):
+        if self.flags is None:
+            self.__load_detail()
+        flags = self.flags
+        for n in range(len(flags)):
+            if flags[n] & flag:
+                yield n
+
+
+    # Rows of the jumps and the calls to addr
+    def iter_xrefs(self, addr):
+        if self.target is None:
+            self.__load_targets()
+        target = self.target
+        for n in self.iter_flag(FLAG_TARGET):
+            if target[n] == addr:
+                yield n
+
+
+    # Rows of the instructions which have an opcode matched by the regex
+    # opcodes, only the prefixes can be before the opcode. It's used to
+    # search the calls on x86 without disassembling all instructions.
+    def iter_opcode(self, opcodes, prefixes):
+        data = self.__binary.section_stream_read(self.start,
+                                                 self.end + 1 - self.start)
+        addr = self.addr
+        size = self.size
+        n = 0
+
+        for m in opcodes.finditer(data):
+            off = m.start()
+            ad = self.start + off
+            n = bisect_right(addr, ad, n) - 1
+            if n == -1:
+                n = 0
+                continue
+            begin = addr[n] - self.start
+            if off - begin >= size[n]:
+                continue
+            for k in range(begin, off):
+                if data[k] not in prefixes:
+                    break
+            else:
+                yield n
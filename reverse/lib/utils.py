@@ -58,6 +58,25 @@ get_char = PRINTABLE.__getitem__
 
 
 
+# Run a recursive function written as a generator without using the
+# python stack. The generator calls another one with :
+#     ret = yield func(...)
+# and returns its result with a normal return.
+def trampoline(gen):
+    stack = [gen]
+    ret = None
+    while stack:
+        try:
+            call = stack[-1].send(ret)
+        except StopIteration as e:
+            stack.pop()
+            ret = e.value
+            continue
+        stack.append(call)
+        ret = None
+    return ret
+
+
 def index(L, obj, k=0):
     try:
         return L.index(obj, k)
@@ -69,6 +88,10 @@ def error(txt):
     print("error: " + txt, file=sys.stderr)
 
 
+def warning(txt):
+    print("warning: " + txt, file=sys.stderr)
+
+
 def die(txt=None):
     if txt is not None:
         print("error: " + txt, file=sys.stderr)
@@ -4,8 +4,10 @@ from contextlib import redirect_stdout
 from nose.tools import assert_equal
 from pathlib import Path
 from io import StringIO
+import re
 
 from reverse import reverse
+from lib import load_file
 from lib.context import Context
 
 TESTS = Path('tests')
@@ -14,10 +16,31 @@ SYMBOLS = {
         TESTS / 'server.bin': ["main", "connection_handler"],
         TESTS / 'pendu.bin': ["_main", "___main"],
         TESTS / 'shellcode.bin': ["0x0"],
+        TESTS / 'mipsret.bin': ["0x0"],
         }
 
 OPTIONS = {
-    TESTS / 'shellcode.bin': ["--raw x86"]
+    TESTS / 'shellcode.bin': ["--raw x86"],
+    TESTS / 'mipsret.bin': ["--raw mips"],
+    }
+
+# With --dominators, the output is the same except for these tests (the
+# gotos are not placed at the same addresses). Their output is compared
+# with tests/dominators/*.rev.
+DOMINATORS_DIFF = {
+    "goto1", "goto2", "goto3", "goto4", "goto5", "goto6",
+    "gotoinloop1", "gotoinloop2", "gotoinloop3", "gotoinloop4",
+    "gotoinloop5", "gotoinloop6", "gotoinloop7", "gotoinloop9",
+    "loopends2", "loopinf2", "loopinf3", "return1",
+    }
+
+# The colors of the labels depend on the order of the walk of the ast,
+# these tests are compared with tests/colors/*.rev (with the colors).
+COLORS = {
+    TESTS / 'goto1.bin': [None],
+    TESTS / 'break3.bin': [None],
+    TESTS / 'gotoinloop9.bin': [None],
+    TESTS / 'server.bin': ["connection_handler"],
     }
 
 
@@ -26,10 +49,44 @@ def test_reverse():
         for symbol in sorted(SYMBOLS.get(p, [None])):
             yield reverse_file, str(p), symbol, OPTIONS.get(p, [])
 
-def reverse_file(filename, symbol, options):
+def test_reverse_dominators():
+    for p in TESTS.glob('*.bin'):
+        if p.stem in DOMINATORS_DIFF:
+            yield reverse_file_dominators, str(p)
+            continue
+        for symbol in sorted(SYMBOLS.get(p, [None])):
+            yield (reverse_file, str(p), symbol,
+                   OPTIONS.get(p, []) + ["--dominators"])
+
+def test_reverse_colors():
+    for p, symbols in COLORS.items():
+        for symbol in symbols:
+            yield reverse_file_colors, str(p), symbol
+
+def test_symbols_loaded_lazily():
+    # main doesn't call a function of the plt : only the static symbols
+    # are loaded
     ctx = Context()
-    ctx.sectionsname = False
     ctx.color = False
+    ctx.filename = str(TESTS / 'nestedloop2.bin')
+    with redirect_stdout(StringIO()):
+        reverse(ctx)
+    assert_equal(len(ctx.dis.binary.reverse_symbols.parts), 1)
+
+def test_symbol_offset():
+    # 0x401940 is a static function after ___main, it's not loaded but
+    # it ends ___main
+    ctx = Context()
+    ctx.filename = str(TESTS / 'pendu.bin')
+    load_file(ctx)
+    binary = ctx.dis.binary
+    assert_equal(binary.get_symbol_name(0x4018c3), "___main+0x3")
+    assert_equal(binary.get_symbol_name(0x401940), None)
+
+def get_output(filename, symbol, options, color=False):
+    ctx = Context()
+    ctx.sectionsname = False
+    ctx.color = color
     ctx.filename = filename
     ctx.entry = symbol
 
@@ -38,10 +95,37 @@ def reverse_file(filename, symbol, options):
             ctx.raw_type = "x86"
         elif o == "--raw x64":
             ctx.raw_type = "x64"
+        elif o == "--raw mips":
+            ctx.raw_type = "mips"
+        elif o == "--dominators":
+            ctx.dominators = True
 
     sio = StringIO()
     with redirect_stdout(sio):
         reverse(ctx)
+    return sio.getvalue()
+
+def get_addresses(output):
+    return set(re.findall(r'^\s*(0x[0-9a-f]+):', output, re.M))
+
+def reverse_file(filename, symbol, options):
+    out = get_output(filename, symbol, options)
     postfix = '{0}.rev'.format('' if symbol is None else '_' + symbol)
     with open(filename.replace('.bin', postfix)) as f:
-        assert_equal(sio.getvalue(), f.read())
+        assert_equal(out, f.read())
+
+def reverse_file_dominators(filename):
+    out = get_output(filename, None, ["--dominators"])
+    with open(str(TESTS / 'dominators' / Path(filename).name).replace(
+            '.bin', '.rev')) as f:
+        assert_equal(out, f.read())
+    # Only the gotos move, all the instructions must be printed
+    with open(filename.replace('.bin', '.rev')) as f:
+        assert_equal(get_addresses(out), get_addresses(f.read()))
+
+def reverse_file_colors(filename, symbol):
+    out = get_output(filename, symbol, [], color=True)
+    postfix = '{0}.rev'.format('' if symbol is None else '_' + symbol)
+    with open(str(TESTS / 'colors' / Path(filename).name).replace(
+            '.bin', postfix)) as f:
+        assert_equal(out, f.read())
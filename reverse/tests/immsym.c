@@ -0,0 +1,12 @@
+#include <stdio.h>
+
+int f(int x) {
+    return x * 3 + 1;
+}
+
+int main(int argc, char **argv) {
+    // The constant is inside the range of f, but it's not an address
+    if (argc == 0x401130)
+        printf("1\n");
+    return f(argc);
+}
@@ -0,0 +1 @@
+#error "This file is just for the make check"